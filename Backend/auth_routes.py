@@ -63,6 +63,7 @@ async def login(login_req: LoginRequest, request: Request):
 
     if user:
         request.session["user"] = user["username"]
+        request.session["user_id"] = user["id"]
         return {"success": True, "message": "Login successful."}
     raise HTTPException(status_code=401, detail="Invalid credentials.")
 
@@ -0,0 +1,465 @@
+# run_bench.py
+"""Offline load test for the chat backend.
+
+Starts stub Ollama nodes (bench/stub_ollama.py) and the FastAPI app under
+uvicorn, drives it with concurrent simulated users (sign up, create chats,
+send prompts, upload decks, page through history) and reports latency
+percentiles, throughput and the app's own per-stage timings from /metrics.
+
+Needs the local Postgres the app connects to (and Redis when USE_CELERY is
+on) and a cached tiktoken encoding (TIKTOKEN_CACHE_DIR); no GPU or network.
+Options this script doesn't know are passed to every stub node.
+
+    python bench/run_bench.py --users 20 --turns 5 --nodes 2 --out before.json
+    python bench/run_bench.py --users 20 --turns 5 --nodes 2 --baseline before.json
+    python bench/run_bench.py --nodes 4 --tokens-per-sec 15 --parallel 1 --fail-rate 0.02
+"""
+import io
+import os
+import sys
+import json
+import time
+import math
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+
+import httpx
+import tiktoken
+from pptx import Presentation
+from prometheus_client.parser import text_string_to_metric_families
+
+import stub_ollama
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+EMAIL_DOMAIN = "@xoriant.com"  # signup only accepts this domain
+
+PROMPTS = [
+    "Summarize the main points of the deck",
+    "What are the risks for next quarter?",
+    "Give me three follow-up questions for the team",
+    "Explain the revenue chart in plain words",
+    "Draft a short status update",
+    "What changed since the last review?",
+]
+
+# ---- Processes ----
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_ready(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+def start_stubs(count: int, stub_argv: List[str], workdir: str) -> Tuple[List[subprocess.Popen], List[str]]:
+    procs, urls = [], []
+    for i in range(count):
+        port = free_port()
+        log = open(os.path.join(workdir, f"stub_{i}.log"), "w")
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "stub_ollama.py"), "--port", str(port), "--seed", str(i), *stub_argv],
+            stdout=log, stderr=subprocess.STDOUT,
+        ))
+        urls.append(f"http://127.0.0.1:{port}")
+    for url in urls:
+        wait_ready(f"{url}/api/tags", 30)
+    return procs, urls
+
+def start_app(node_urls: List[str], workers: int, workdir: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ, OLLAMA_HOSTS=",".join(node_urls), OLLAMA_EMBED_URL=node_urls[0])
+    if workers > 1:
+        # /metrics has to aggregate across uvicorn workers
+        env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="metrics_", dir=workdir)
+    log = open(os.path.join(workdir, "app.log"), "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR, "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_ready(f"{url}/metrics", 120)
+    except RuntimeError:
+        proc.terminate()
+        raise RuntimeError(f"App failed to start; see {os.path.join(workdir, 'app.log')}")
+    return proc, url
+
+def stop(procs: List[subprocess.Popen]) -> None:
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def check_tokenizer() -> None:
+    # tiktoken downloads encodings on first use, which an offline box can't do
+    encoding = os.getenv("TOKENIZER_DEFAULT_ENCODING", "cl100k_base")
+    try:
+        tiktoken.get_encoding(encoding)
+    except Exception as e:
+        raise SystemExit(f"tiktoken encoding '{encoding}' is not cached ({type(e).__name__}); "
+                         f"fetch it once on a connected machine and point TIKTOKEN_CACHE_DIR at the cache")
+
+def build_deck(slides: int = 6) -> bytes:
+    deck = Presentation()
+    for i in range(slides):
+        slide = deck.slides.add_slide(deck.slide_layouts[1])
+        slide.shapes.title.text = f"Quarterly review part {i + 1}"
+        slide.placeholders[1].text = " ".join(random.Random(i).choice(stub_ollama.WORDS) for _ in range(80))
+    out = io.BytesIO()
+    deck.save(out)
+    return out.getvalue()
+
+# ---- Recording ----
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_examples: Dict[str, str] = {}
+        self.ttft: List[float] = []
+
+    @asynccontextmanager
+    async def op(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.errors[name] += 1
+            self.error_examples.setdefault(name, f"{type(e).__name__}: {e}"[:200])
+        else:
+            self.samples[name].append(time.perf_counter() - start)
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(max(math.ceil(q * len(ordered)) - 1, 0), len(ordered) - 1)]
+
+def summarize(values: List[float], errors: int, elapsed: float) -> dict:
+    return {
+        "count": len(values),
+        "errors": errors,
+        "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+# ---- Simulated user ----
+def check(response: httpx.Response) -> httpx.Response:
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.text[:120]}")
+    return response
+
+async def check_stream(response: httpx.Response) -> httpx.Response:
+    if response.status_code >= 400:
+        await response.aread()
+    return check(response)
+
+async def follow_task(client: httpx.AsyncClient, task_id: str, chat_id: int, recorder: Recorder, start: float) -> None:
+    # Celery mode: the reply arrives over server-sent events
+    async with client.stream("GET", "/api/task_events", params={"task_id": task_id, "chat_id": chat_id}) as res:
+        await check_stream(res)
+        first = True
+        async for line in res.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event.get("error"):
+                raise RuntimeError(event["error"])
+            if first and event.get("token"):
+                recorder.ttft.append(time.perf_counter() - start)
+                first = False
+            if event.get("done"):
+                return
+    raise RuntimeError("event stream ended without a result")
+
+async def send_prompt(client: httpx.AsyncClient, chat_id: int, args, rng: random.Random,
+                      recorder: Recorder, deck: bytes) -> None:
+    data = {"prompt": rng.choice(PROMPTS), "model": args.model, "chat_id": str(chat_id)}
+    files = {"file": ("deck.pptx", deck, "application/vnd.openxmlformats-officedocument.presentationml.presentation")} \
+        if rng.random() < args.pptx_fraction else None
+    stream = rng.random() < args.stream_fraction
+    name = "respond_pptx" if files else "respond_stream" if stream else "respond"
+
+    async with recorder.op(name):
+        start = time.perf_counter()
+        if not stream:
+            body = check(await client.post("/api/respond", data=data, files=files)).json()
+            if "task_id" in body:
+                await follow_task(client, body["task_id"], chat_id, recorder, start)
+            return
+        data["stream"] = "true"
+        async with client.stream("POST", "/api/respond", data=data, files=files) as res:
+            await check_stream(res)
+            first, done = True, False
+            async for line in res.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event.get("error"):
+                    raise RuntimeError(event["error"])
+                if first and event.get("token"):
+                    recorder.ttft.append(time.perf_counter() - start)
+                    first = False
+                if "task_id" in event:
+                    await follow_task(client, event["task_id"], chat_id, recorder, start)
+                    done = True
+                done = done or bool(event.get("done"))
+            if not done:
+                raise RuntimeError("stream ended without done")
+
+async def simulate_user(base_url: str, user_no: int, turns: int, args, recorder: Recorder, deck: bytes) -> None:
+    rng = random.Random(args.seed * 100003 + user_no)
+    name = f"bench{os.getpid()}_{user_no}_{rng.randrange(10**6)}"
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout) as client:
+        async with recorder.op("signup"):
+            check(await client.post("/signup", json={"username": name, "email": name + EMAIL_DOMAIN, "password": "bench"}))
+        async with recorder.op("login"):
+            check(await client.post("/login", json={"identifier": name, "password": "bench"}))
+        chat_id = None
+        async with recorder.op("create_chat"):
+            chat_id = check(await client.post("/api/create_chat", json={"title": "New Chat"})).json()["chat_id"]
+        if chat_id is None:
+            return
+
+        for turn in range(turns):
+            await send_prompt(client, chat_id, args, rng, recorder, deck)
+            if args.history_every and (turn + 1) % args.history_every == 0:
+                async with recorder.op("history_page"):
+                    check(await client.get("/api/chat_history", params={"chat_id": chat_id, "limit": args.history_page}))
+                async with recorder.op("list_chats"):
+                    check(await client.get("/api/list_chats"))
+            if args.think_ms:
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think_ms / 1000)
+
+        if not args.keep_data:
+            async with recorder.op("delete_chat"):
+                check(await client.post("/api/delete_chat", params={"chat_id": chat_id}))
+
+# ---- /metrics ----
+async def scrape(base_url: str) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        text = (await client.get("/metrics")).text
+    samples = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            samples[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+    return samples
+
+def histogram_deltas(before: dict, after: dict, metric: str, label: str) -> Dict[str, dict]:
+    # Per label value: cumulative bucket counts, sum and count accrued during the run
+    series = defaultdict(lambda: {"buckets": {}, "sum": 0.0, "count": 0.0})
+    for (name, labels), value in after.items():
+        labels = dict(labels)
+        if not name.startswith(metric) or label not in labels:
+            continue
+        entry = series[labels[label]]
+        delta = value - before.get((name, tuple(sorted(labels.items()))), 0.0)
+        if name == f"{metric}_bucket":
+            le = float(labels["le"])
+            entry["buckets"][le] = entry["buckets"].get(le, 0.0) + delta
+        elif name == f"{metric}_sum":
+            entry["sum"] += delta
+        elif name == f"{metric}_count":
+            entry["count"] += delta
+    return {k: v for k, v in series.items() if v["count"] > 0}
+
+def bucket_quantile(buckets: Dict[float, float], q: float) -> float:
+    # Same linear interpolation as PromQL's histogram_quantile
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if not total:
+        return 0.0
+    rank, lower, lower_count = q * total, 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if math.isinf(bound):
+                return lower
+            return lower + (bound - lower) * ((rank - lower_count) / (count - lower_count) if count > lower_count else 0)
+        lower, lower_count = bound, count
+    return lower
+
+def stage_report(before: dict, after: dict, metric: str, label: str) -> Dict[str, dict]:
+    return {
+        key: {
+            "count": int(entry["count"]),
+            "mean": round(entry["sum"] / entry["count"], 4),
+            "p50": round(bucket_quantile(entry["buckets"], 0.50), 4),
+            "p95": round(bucket_quantile(entry["buckets"], 0.95), 4),
+        }
+        for key, entry in sorted(histogram_deltas(before, after, metric, label).items())
+    }
+
+def node_requests(before: dict, after: dict) -> Dict[str, dict]:
+    nodes = defaultdict(lambda: defaultdict(int))
+    for (name, labels), value in after.items():
+        if name == "chatbot_ollama_request_seconds_count":
+            labels = dict(labels)
+            delta = value - before.get((name, tuple(sorted(labels.items()))), 0.0)
+            if delta:
+                nodes[labels["node"]][labels["outcome"]] += int(delta)
+    return {node: dict(outcomes) for node, outcomes in sorted(nodes.items())}
+
+# ---- Report ----
+def print_table(title: str, rows: Dict[str, dict], columns: List[str]) -> None:
+    if not rows:
+        return
+    print(f"\n{title}")
+    width = max(len(k) for k in rows) + 2
+    print("".ljust(width) + "".join(c.rjust(10) for c in columns))
+    for key, row in rows.items():
+        print(key.ljust(width) + "".join(str(row.get(c, "")).rjust(10) for c in columns))
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['users']} users x {report['turns']} turns over {report['nodes']} stub node(s): "
+          f"{report['requests']} requests, {report['errors']} errors in {report['duration_s']}s "
+          f"({report['throughput_rps']} req/s)")
+    print_table("Client-side latency (s)", report["operations"], ["count", "errors", "rps", "p50", "p95", "p99", "max"])
+    if report["ttft"]["count"]:
+        print_table("Time to first token (s)", {"ttft": report["ttft"]}, ["count", "p50", "p95", "p99", "max"])
+    print_table("Server stages from /metrics (s)", report["stages"], ["count", "mean", "p50", "p95"])
+    print_table("Ollama requests per node", report["ollama_nodes"], ["ok", "error", "cancelled"])
+    for name, example in report["error_examples"].items():
+        print(f"  {name} error: {example}")
+
+def compare(report: dict, baseline: dict, tolerance: float, min_delta: float) -> List[str]:
+    regressions = []
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%})")
+    for key in ("users", "turns", "nodes", "model", "stub_args"):
+        if baseline.get(key) != report.get(key):
+            print(f"  warning: {key} differs ({baseline.get(key)} vs {report.get(key)}); results may not be comparable")
+    for name, current in report["operations"].items():
+        base = baseline.get("operations", {}).get(name)
+        if not base or not base["p95"]:
+            continue
+        change = current["p95"] / base["p95"] - 1
+        # Millisecond endpoints jitter by large fractions; only real slowdowns count
+        flag = "REGRESSION" if change > tolerance and current["p95"] - base["p95"] > min_delta else ""
+        print(f"  {name:<16} p95 {base['p95']:.4f}s -> {current['p95']:.4f}s ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(name)
+    if baseline.get("throughput_rps"):
+        change = report["throughput_rps"] / baseline["throughput_rps"] - 1
+        flag = "REGRESSION" if change < -tolerance else ""
+        print(f"  {'throughput':<16} {baseline['throughput_rps']} -> {report['throughput_rps']} req/s ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append("throughput")
+    return regressions
+
+# ---- Main ----
+async def run_load(base_url: str, args, deck: bytes) -> dict:
+    if args.warmup:
+        # Model info, tokenizer and connection pools are loaded outside the measured window
+        await simulate_user(base_url, -1, args.warmup, args, Recorder(), deck)
+    before = await scrape(base_url)
+    recorder = Recorder()
+
+    async def user(i: int):
+        await asyncio.sleep(args.ramp_s * i / max(args.users, 1))
+        await simulate_user(base_url, i, args.turns, args, recorder, deck)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - start
+    after = await scrape(base_url)
+
+    requests = sum(len(v) for v in recorder.samples.values())
+    errors = sum(recorder.errors.values())
+    ops = sorted(set(recorder.samples) | set(recorder.errors))
+    return {
+        "users": args.users, "turns": args.turns, "nodes": args.nodes, "model": args.model,
+        "stub_args": args.stub_argv,
+        "duration_s": round(elapsed, 3),
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "operations": {op: summarize(recorder.samples[op], recorder.errors[op], elapsed) for op in ops},
+        "ttft": summarize(recorder.ttft, 0, elapsed),
+        "stages": stage_report(before, after, "chatbot_stage_seconds", "stage"),
+        "responses": stage_report(before, after, "chatbot_response_seconds", "source"),
+        "ollama_nodes": node_requests(before, after),
+        "error_examples": dict(recorder.error_examples),
+    }
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="prompts each user sends")
+    parser.add_argument("--nodes", type=int, default=2, help="stub Ollama nodes to start")
+    parser.add_argument("--model", default="mistral")
+    parser.add_argument("--stream-fraction", type=float, default=0.5)
+    parser.add_argument("--pptx-fraction", type=float, default=0.1)
+    parser.add_argument("--history-every", type=int, default=2, help="read history every N turns (0 = never)")
+    parser.add_argument("--history-page", type=int, default=50)
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's turns")
+    parser.add_argument("--ramp-s", type=float, default=1.0, help="spread user start times over this many seconds")
+    parser.add_argument("--warmup", type=int, default=1, help="turns sent before measuring")
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--app-workers", type=int, default=1)
+    parser.add_argument("--app-url", help="benchmark an already running app (its Ollama hosts are used as configured)")
+    parser.add_argument("--keep-data", action="store_true", help="don't delete the benchmark chats afterwards")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed p95/throughput change vs baseline")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="p95 increases below this many seconds are noise")
+    args, stub_argv = parser.parse_known_args(argv)
+    stub_ollama.parse_args(stub_argv)  # reject typos before anything starts
+    args.stub_argv = stub_argv
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    deck = build_deck()
+    procs = []
+    workdir = tempfile.mkdtemp(prefix="chatbot_bench_")
+    try:
+        base_url = args.app_url
+        if base_url is None:
+            check_tokenizer()
+            stubs, node_urls = start_stubs(args.nodes, args.stub_argv, workdir)
+            procs.extend(stubs)
+            app, base_url = start_app(node_urls, args.app_workers, workdir)
+            procs.append(app)
+        report = asyncio.run(run_load(base_url, args, deck))
+    finally:
+        stop(procs)
+
+    print_report(report)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.out}")
+    if args.app_url is None:
+        print(f"Stub and app logs: {workdir}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(report, json.load(f), args.tolerance, args.min_delta):
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
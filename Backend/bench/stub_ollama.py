@@ -0,0 +1,146 @@
+# stub_ollama.py
+"""Stand-in for an Ollama node, for benchmarks on machines with no GPU.
+
+Speaks the parts of Ollama's API the backend uses (/api/generate streamed
+and not, /api/embed, /api/embeddings, /api/tags, /api/ps, /api/show) with
+configurable prefill and decode speed, a per-node parallelism limit and
+failure injection. Embeddings are deterministic hashes of the input.
+
+    python bench/stub_ollama.py --port 12434 --tokens-per-sec 40 --parallel 2
+"""
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+
+from aiohttp import web
+
+WORDS = ("the model answers with a short plain sentence about slides charts revenue "
+         "growth quarter team plan risk summary next steps").split()
+
+class StubOllama:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.slots = asyncio.Semaphore(args.parallel)  # like OLLAMA_NUM_PARALLEL; the rest queue
+
+    def _jitter(self, seconds: float) -> float:
+        return max(seconds * self.random.uniform(1 - self.args.jitter, 1 + self.args.jitter), 0.0)
+
+    def _prefill_seconds(self, prompt: str) -> float:
+        prompt_tokens = len(prompt.split())
+        return self._jitter(self.args.ttft_ms / 1000 + prompt_tokens / self.args.prefill_tokens_per_sec)
+
+    def _failed(self) -> bool:
+        return self.random.random() < self.args.fail_rate
+
+    def _tokens(self):
+        for i in range(self.args.response_tokens):
+            yield ("" if i == 0 else " ") + self.random.choice(WORDS)
+
+    def _final(self, model: str, prompt: str, prefill: float, decode: float, **extra) -> dict:
+        return {
+            "model": model, "done": True, "done_reason": "stop",
+            "prompt_eval_count": len(prompt.split()), "prompt_eval_duration": int(prefill * 1e9),
+            "eval_count": self.args.response_tokens, "eval_duration": int(decode * 1e9),
+            **extra,
+        }
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model, prompt = body.get("model", ""), body.get("prompt", "")
+        if self._failed():
+            return web.json_response({"error": "injected failure"}, status=500)
+        async with self.slots:
+            prefill = self._prefill_seconds(prompt)
+            await asyncio.sleep(prefill)
+            token_delay = 1 / self.args.tokens_per_sec
+            if not body.get("stream", True):
+                decode = self._jitter(token_delay * self.args.response_tokens)
+                await asyncio.sleep(decode)
+                return web.json_response(self._final(model, prompt, prefill, decode, response="".join(self._tokens())))
+
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            drop_at = self.random.randrange(self.args.response_tokens) if self.random.random() < self.args.drop_rate else None
+            decode_start = asyncio.get_running_loop().time()
+            for i, token in enumerate(self._tokens()):
+                if i == drop_at:
+                    # Node dies mid-stream: the client sees a truncated body
+                    request.transport.close()
+                    return response
+                await response.write((json.dumps({"model": model, "response": token, "done": False}) + "\n").encode())
+                await asyncio.sleep(self._jitter(token_delay))
+            decode = asyncio.get_running_loop().time() - decode_start
+            await response.write((json.dumps(self._final(model, prompt, prefill, decode, response="")) + "\n").encode())
+            await response.write_eof()
+            return response
+
+    def _vector(self, text: str) -> list:
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=64).digest()
+        return [(digest[i % len(digest)] - 127.5) / 127.5 for i in range(self.args.embedding_dim)]
+
+    async def embed(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        if self._failed():
+            return web.json_response({"error": "injected failure"}, status=500)
+        await asyncio.sleep(self._jitter((self.args.embed_ms + self.args.embed_ms_per_input * len(inputs)) / 1000))
+        return web.json_response({"model": body.get("model"), "embeddings": [self._vector(t) for t in inputs]})
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        # Legacy single-prompt endpoint
+        body = await request.json()
+        if self._failed():
+            return web.json_response({"error": "injected failure"}, status=500)
+        await asyncio.sleep(self._jitter((self.args.embed_ms + self.args.embed_ms_per_input) / 1000))
+        return web.json_response({"embedding": self._vector(body.get("prompt", ""))})
+
+    def _model_entries(self) -> list:
+        return [{"name": m, "model": m, "size": 0} for m in self.args.models]
+
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": self._model_entries()})
+
+    async def ps(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": self._model_entries()})
+
+    async def show(self, request: web.Request) -> web.Response:
+        return web.json_response({"model_info": {"general.architecture": "stub", "stub.context_length": self.args.context_length}})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/api/generate", self.generate),
+            web.post("/api/embed", self.embed),
+            web.post("/api/embeddings", self.embeddings),
+            web.get("/api/tags", self.tags),
+            web.get("/api/ps", self.ps),
+            web.post("/api/show", self.show),
+        ])
+        return app
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=12434)
+    parser.add_argument("--models", nargs="+", default=["mistral:latest", "nomic-embed-text:latest"])
+    parser.add_argument("--ttft-ms", type=float, default=150, help="fixed delay before the first token")
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=2000, help="prompt words processed per second")
+    parser.add_argument("--tokens-per-sec", type=float, default=30, help="decode rate")
+    parser.add_argument("--response-tokens", type=int, default=60)
+    parser.add_argument("--parallel", type=int, default=4, help="concurrent generations before requests queue")
+    parser.add_argument("--embed-ms", type=float, default=15)
+    parser.add_argument("--embed-ms-per-input", type=float, default=2)
+    parser.add_argument("--embedding-dim", type=int, default=768)
+    parser.add_argument("--context-length", type=int, default=8192)
+    parser.add_argument("--jitter", type=float, default=0.1, help="+/- fraction applied to every delay")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of streams cut off mid-response")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    web.run_app(StubOllama(args).app(), host="127.0.0.1", port=args.port, print=None)
@@ -0,0 +1,91 @@
+# cancellation.py
+import os
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+from fastapi import Request
+
+from metrics import GENERATIONS_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ---- Config ----
+# Wall-clock budget for one reply, queueing included; also handed to Celery workers
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "300"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+# Returns a reason to stop (e.g. "client_disconnect") or None to carry on
+Probe = Callable[[], Awaitable[Optional[str]]]
+
+class Deadline:
+    def __init__(self, seconds: float = REQUEST_DEADLINE_SECONDS, start: Optional[float] = None):
+        # Epoch time rather than a monotonic clock so another process can enforce it
+        self.expires_at = (start if start is not None else time.time()) + seconds
+
+    @classmethod
+    def at(cls, expires_at: float) -> "Deadline":
+        return cls(0, start=expires_at)
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.time(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+def disconnect_probe(request: Request) -> Probe:
+    async def probe() -> Optional[str]:
+        return "client_disconnect" if await request.is_disconnected() else None
+    return probe
+
+async def _watch(task: "asyncio.Future[T]", deadline: Deadline, probe: Optional[Probe], poll: float) -> T:
+    # Cancelling the task closes its upstream HTTP request, which makes Ollama stop generating
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=max(min(poll, deadline.remaining()), 0.01))
+            if task.done():
+                break
+            reason = "deadline" if deadline.expired else (await probe() if probe is not None else None)
+            if reason is None:
+                continue
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            GENERATIONS_CANCELLED.labels(reason).inc()
+            logger.info(f"Generation cancelled: {reason}")
+            raise GenerationCancelled(reason)
+    except asyncio.CancelledError:
+        # Our caller was cancelled (e.g. the server saw the disconnect first); let the task unwind too
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        GENERATIONS_CANCELLED.labels("aborted").inc()
+        raise
+    return task.result()
+
+async def run_guarded(awaitable: Awaitable[T], deadline: Deadline, probe: Optional[Probe] = None,
+                      poll: float = DISCONNECT_POLL_SECONDS) -> T:
+    """Await a generation, cancelling it when the deadline passes or the
+    probe reports a reason to stop (both raise GenerationCancelled)."""
+    return await _watch(asyncio.ensure_future(awaitable), deadline, probe, poll)
+
+async def stream_guarded(iterator: AsyncIterator[T], deadline: Deadline, probe: Optional[Probe] = None,
+                         poll: float = DISCONNECT_POLL_SECONDS) -> AsyncIterator[T]:
+    """Streaming counterpart of run_guarded; also checks while waiting for
+    the first token, when nothing would be written to notice a disconnect."""
+    try:
+        while True:
+            try:
+                item = await _watch(asyncio.ensure_future(iterator.__anext__()), deadline, probe, poll)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await iterator.aclose()
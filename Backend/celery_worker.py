@@ -1,13 +1,60 @@
 # celery_worker.py
 from celery import Celery
+from celery.signals import celeryd_init
+from kombu import Exchange, Queue
 import os
 
+from ollama_pool import normalize_model
+
 # Load from environment or default values
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = os.getenv("REDIS_PORT", "6379")
 BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
 BACKEND_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/1"
 
+# --- Queues ---
+# Replies go to "interactive" (or "interactive.<model>" for models with a dedicated
+# queue, so the workers serving it keep that model warm); titles and summaries go
+# to "background". Run them as separate workers, e.g.
+#   CELERY_WORKER_ROLE=interactive CELERY_WORKER_MODELS=mistral celery -A celery_worker worker
+#   CELERY_WORKER_ROLE=background celery -A celery_worker worker
+INTERACTIVE_QUEUE = "interactive"
+BACKGROUND_QUEUE = "background"
+
+def _model_list(value: str) -> list:
+    return [normalize_model(m.strip()) for m in value.split(",") if m.strip()]
+
+CELERY_MODEL_QUEUES = _model_list(os.getenv("CELERY_MODEL_QUEUES", ""))
+CELERY_WORKER_ROLE = os.getenv("CELERY_WORKER_ROLE", "all")  # interactive | background | all
+CELERY_WORKER_MODELS = _model_list(os.getenv("CELERY_WORKER_MODELS", ""))
+CELERY_INTERACTIVE_CONCURRENCY = int(os.getenv("CELERY_INTERACTIVE_CONCURRENCY", "4"))
+CELERY_BACKGROUND_CONCURRENCY = int(os.getenv("CELERY_BACKGROUND_CONCURRENCY", "1"))
+
+# Redis priorities: 0 is consumed first
+INTERACTIVE_PRIORITY = 0
+TITLE_PRIORITY = 3
+SUMMARY_PRIORITY = 6
+
+def model_queue(model: str) -> str:
+    return f"{INTERACTIVE_QUEUE}.{normalize_model(model)}"
+
+def _queue(name: str) -> Queue:
+    # Own exchange and routing key; otherwise Celery binds every queue to the default one
+    return Queue(name, Exchange(name, type="direct"), routing_key=name)
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    if name == "tasks.generate_response_task":
+        model = kwargs.get("model") or (args[0] if args else None)
+        queue = INTERACTIVE_QUEUE
+        if model and normalize_model(model) in CELERY_MODEL_QUEUES:
+            queue = model_queue(model)
+        return {"queue": queue, "priority": INTERACTIVE_PRIORITY}
+    if name == "tasks.generate_title_task":
+        return {"queue": BACKGROUND_QUEUE, "priority": TITLE_PRIORITY}
+    if name == "tasks.summarize_chat_task":
+        return {"queue": BACKGROUND_QUEUE, "priority": SUMMARY_PRIORITY}
+    return None
+
 celery_app = Celery(
     "chatbot_worker",
     broker=BROKER_URL,
@@ -24,4 +71,20 @@ celery_app.conf.update(
     accept_content=['json'],
     worker_prefetch_multiplier=1,  # Prevent Celery from grabbing too many tasks at once
     task_acks_late=True,  # Retry task if worker crashes mid-execution
+    task_queues=[_queue(INTERACTIVE_QUEUE), _queue(BACKGROUND_QUEUE)] + [_queue(model_queue(m)) for m in CELERY_MODEL_QUEUES],
+    task_default_queue=BACKGROUND_QUEUE,
+    task_routes=(route_task,),
+    task_default_priority=SUMMARY_PRIORITY,
+    broker_transport_options={"queue_order_strategy": "priority", "priority_steps": list(range(10))},
 )
+
+@celeryd_init.connect
+def configure_worker_role(sender=None, instance=None, conf=None, **kwargs):
+    # An explicit -Q/-c on the command line still wins over the role defaults
+    if CELERY_WORKER_ROLE == "interactive":
+        models = [m for m in CELERY_WORKER_MODELS if m in CELERY_MODEL_QUEUES] or CELERY_MODEL_QUEUES
+        instance.app.amqp.queues.select([INTERACTIVE_QUEUE] + [model_queue(m) for m in models])
+        conf.worker_concurrency = CELERY_INTERACTIVE_CONCURRENCY
+    elif CELERY_WORKER_ROLE == "background":
+        instance.app.amqp.queues.select([BACKGROUND_QUEUE])
+        conf.worker_concurrency = CELERY_BACKGROUND_CONCURRENCY
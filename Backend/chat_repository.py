@@ -0,0 +1,144 @@
+# chat_repository.py
+import os
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from utils import database
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 200
+
+# ---- Users ----
+async def get_session_user_id(request: Request) -> int:
+    # The id is cached in the session at login; older sessions fill it in on first use
+    username = request.session.get("user")
+    if not username:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    user_id = request.session.get("user_id")
+    if user_id is None:
+        user_id = await database.fetch_val("SELECT id FROM users WHERE username = :u", {"u": username})
+        if user_id is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        request.session["user_id"] = user_id
+    return user_id
+
+# ---- Chats ----
+async def get_owned_chat(chat_id: int, user_id: int) -> dict:
+    """Ownership check plus everything /api/respond needs about the chat, in one query."""
+    row = await database.fetch_one(
+        """
+        SELECT c.user_id, c.title, COALESCE(s.summary, '') AS summary
+        FROM chats c
+        LEFT JOIN chat_summaries s ON s.chat_id = c.id
+        WHERE c.id = :cid
+        """,
+        {"cid": chat_id}
+    )
+    if row is None or row["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return dict(row)
+
+LIST_CHATS_QUERY = "SELECT id, title, created_at FROM chats WHERE user_id = :uid ORDER BY created_at DESC"
+
+async def list_chats(user_id: int) -> list:
+    return [dict(r) for r in await database.fetch_all(LIST_CHATS_QUERY, {"uid": user_id})]
+
+async def create_chat(user_id: int, title: str) -> int:
+    return await database.fetch_val(
+        """
+        WITH chat AS (
+            INSERT INTO chats (user_id, title) VALUES (:uid, :title) RETURNING id
+        ), memory AS (
+            INSERT INTO chat_memory (chat_id, memory) SELECT id, '' FROM chat
+        ), summary AS (
+            INSERT INTO chat_summaries (chat_id, summary) SELECT id, '' FROM chat
+        )
+        SELECT id FROM chat
+        """,
+        {"uid": user_id, "title": title}
+    )
+
+async def delete_chat(chat_id: int, user_id: int) -> bool:
+    # Messages, memory and summary go with the chat via ON DELETE CASCADE
+    deleted = await database.fetch_val(
+        "DELETE FROM chats WHERE id = :cid AND user_id = :uid RETURNING id",
+        {"cid": chat_id, "uid": user_id}
+    )
+    if deleted is not None:
+        return True
+    if await database.fetch_val("SELECT 1 FROM chats WHERE id = :cid", {"cid": chat_id}):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return False
+
+# ---- Messages ----
+async def save_user_message(chat_id: int, prompt: str) -> int:
+    # Stored before generation, so a failed or cancelled turn still keeps the prompt
+    return await database.fetch_val(
+        "INSERT INTO messages (chat_id, role, content) VALUES (:cid, 'user', :prompt) RETURNING id",
+        {"cid": chat_id, "prompt": prompt}
+    )
+
+async def save_reply(chat_id: int, response: str) -> int:
+    """Store the assistant reply and count the finished exchange in the same
+    statement. Returns the chat's message_count, which only counts answered
+    turns (two messages each)."""
+    return await database.fetch_val(
+        """
+        WITH reply AS (
+            INSERT INTO messages (chat_id, role, content) VALUES (:cid, 'assistant', :response)
+            RETURNING id
+        )
+        UPDATE chats SET message_count = message_count + 2
+        WHERE id = :cid
+        RETURNING message_count
+        """,
+        {"cid": chat_id, "response": response}
+    )
+
+async def fetch_recent_messages(chat_id: int, limit: int) -> list:
+    # Only the tail the context builder can use, returned oldest-first
+    rows = await database.fetch_all(
+        """
+        SELECT id, role, content FROM (
+            SELECT id, role, content, timestamp FROM messages
+            WHERE chat_id = :cid
+            ORDER BY timestamp DESC, id DESC
+            LIMIT :limit
+        ) recent
+        ORDER BY timestamp ASC, id ASC
+        """,
+        {"cid": chat_id, "limit": limit}
+    )
+    return [dict(r) for r in rows]
+
+def history_page_query(chat_id: int, limit: int, before: Optional[int] = None) -> Tuple[str, dict]:
+    # Fetches one row past the page so the caller can tell whether more exist
+    params = {"cid": chat_id, "limit": limit + 1}
+    cursor_filter = ""
+    if before is not None:
+        cursor_filter = """
+            AND (timestamp, id) < (SELECT timestamp, id FROM messages WHERE id = :before AND chat_id = :cid)
+        """
+        params["before"] = before
+    query = f"""
+        SELECT id, role, content FROM messages
+        WHERE chat_id = :cid {cursor_filter}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT :limit
+    """
+    return query, params
+
+async def fetch_history_page(chat_id: int, limit: Optional[int] = None, before: Optional[int] = None) -> dict:
+    """Keyset page of messages older than the `before` message id (newest page
+    when omitted). Messages come back oldest-first; next_cursor is the id to
+    pass as `before` for the previous page."""
+    limit = max(1, min(limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE))
+    rows = await database.fetch_all(*history_page_query(chat_id, limit, before))
+    has_more = len(rows) > limit
+    page = [dict(r) for r in rows[:limit]][::-1]
+    return {
+        "messages": page,
+        "has_more": has_more,
+        "next_cursor": page[0]["id"] if has_more and page else None,
+    }
@@ -1,31 +1,46 @@
 from fastapi import APIRouter, Request, HTTPException, Form, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import Optional
-import logging, os, io, shutil, asyncio
-from pptx import Presentation
-from langchain.docstore.document import Document
-from langchain.prompts import PromptTemplate
+from typing import List, Optional
+import logging, os, shutil, asyncio, json
 from celery.result import AsyncResult
 from utils import response_time_logger
 import time
+import aiohttp
+from http_client import get_http_session
+from ollama_pool import ollama_pool
+from index_manager import index_manager, run_in_faiss_pool
+from ingest import ingest_pptx
+import chat_repository
+from chat_repository import get_session_user_id, get_owned_chat
+from context_builder import get_context_limit, pack_context, RECENT_HISTORY_MAX_MESSAGES
 from tasks import generate_response_task
 from utils import (
-    get_llm, remove_think_tags, count_tokens, trim_context,get_relevant_context,
-    calculate_response_token_budget, summarize_chat, generate_title,
-    global_embedding_model, get_faiss_index, save_faiss_index, database
+    get_llm, chat_affinity_key, remove_think_tags, ThinkTagFilter, aretrieve_context,
+    extract_text_from_pptx, get_embedding_model, database
 )
-from tasks import generate_title_task, summarize_chat_task
+from tasks import schedule_followups, cancel_response_task, cancel_abandoned_task
+from task_events import subscribe_events, is_final
+from task_admission import record_interactive_latency
+from response_cache import response_cache, RESPONSE_CACHE_BYPASS_HEADER
+from embedding_cache import embedding_cache
+from generation_admission import generation_admission
+from cancellation import Deadline, GenerationCancelled, run_guarded, stream_guarded, disconnect_probe
+from metrics import timed, STAGE_SECONDS, RESPONSE_SECONDS, TIME_TO_FIRST_TOKEN
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
-faiss_cache = {}
 
-MODEL_TOKEN_LIMITS = {
-    "gemma:2b": 8192, "gemma:1.1b": 8192, "mistral:7b": 8192, "llama3:8b": 8192,
-    "llama3:70b": 8192, "llama2:7b": 4096, "deepseek:1.3b": 8192, "phi3:3b": 8192,
-    "mixtral": 32768, "dolphin-mixtral": 32768
-}
+DEADLINE_MESSAGE = "The response took too long. Please try again."
+
+_background_tasks = set()
+
+def run_in_background(coro):
+    # Keeps a reference so the task isn't garbage-collected mid-flight
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 class ChatRequest(BaseModel):
     title: Optional[str] = "New Chat"
@@ -34,90 +49,61 @@ class RenameChatRequest(BaseModel):
     chat_id: int
     new_title: str
 
-@router.on_event("startup")
-async def connect_db():
-    await database.connect()
-
-@router.on_event("shutdown")
-async def disconnect_db():
-    await database.disconnect()
-
 @router.get("/api/get_models")
 async def get_models():
-    import requests
-    try:
-        res = requests.get("http://localhost:11434/api/tags", timeout=10)
-        res.raise_for_status()
-        models = [m['name'] for m in res.json().get("models", [])]
-        return {"response": [models]}
-    except Exception as e:
-        return {"response": [[]], "error": str(e)}
-
-def get_user_session(request: Request):
-    username = request.session.get("user")
-    if not username:
-        raise HTTPException(status_code=401, detail="Unauthorized")
-    return username
+    error = "No Ollama nodes configured"
+    for node in ollama_pool.healthy_nodes():
+        try:
+            async with get_http_session().get(f"{node.base_url}/api/tags", timeout=aiohttp.ClientTimeout(total=10)) as res:
+                res.raise_for_status()
+                data = await res.json()
+            models = [m['name'] for m in data.get("models", [])]
+            return {"response": [models]}
+        except Exception as e:
+            error = str(e)
+    return {"response": [[]], "error": error}
 
 @router.get("/api/list_chats")
 async def list_chats(request: Request):
-    username = get_user_session(request)
-    user = await database.fetch_one("SELECT id FROM users WHERE username = :username", {"username": username})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    rows = await database.fetch_all(
-        "SELECT id, title, created_at FROM chats WHERE user_id = :uid ORDER BY created_at DESC",
-        {"uid": user["id"]}
-    )
-    return {"chats": [dict(r) for r in rows]}
+    user_id = await get_session_user_id(request)
+    return {"chats": await chat_repository.list_chats(user_id)}
 
 @router.get("/api/chat_history")
-async def chat_history(chat_id: int, request: Request):
-    username = get_user_session(request)
-    user_id = await database.fetch_val("SELECT id FROM users WHERE username = :u", {"u": username})
+async def chat_history(chat_id: int, request: Request, limit: Optional[int] = None, before: Optional[int] = None):
+    user_id = await get_session_user_id(request)
     chat_owner = await database.fetch_val("SELECT user_id FROM chats WHERE id = :cid", {"cid": chat_id})
     if chat_owner != user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
+    # Paginated when limit/before is given; otherwise the full list as before
+    if limit is not None or before is not None:
+        return await chat_repository.fetch_history_page(chat_id, limit, before)
+
     rows = await database.fetch_all(
-        "SELECT role, content FROM messages WHERE chat_id = :cid ORDER BY timestamp ASC",
+        "SELECT role, content FROM messages WHERE chat_id = :cid ORDER BY timestamp ASC, id ASC",
         {"cid": chat_id}
     )
     return [dict(r) for r in rows]
 
 @router.post("/api/create_chat")
 async def create_chat(req: ChatRequest, request: Request):
-    username = get_user_session(request)
-    user = await database.fetch_one("SELECT id FROM users WHERE username = :username", {"username": username})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    query = "INSERT INTO chats (user_id, title) VALUES (:uid, :title) RETURNING id"
-    chat_id = await database.fetch_val(query, {"uid": user["id"], "title": req.title})
-    await database.execute("INSERT INTO chat_memory (chat_id, memory) VALUES (:cid, '')", {"cid": chat_id})
-    await database.execute("INSERT INTO chat_summaries (chat_id, summary) VALUES (:cid, '')", {"cid": chat_id})
+    user_id = await get_session_user_id(request)
+    chat_id = await chat_repository.create_chat(user_id, req.title)
     return {"success": True, "chat_id": chat_id, "title": req.title}
 
 @router.post("/api/delete_chat")
 async def delete_chat(chat_id: int, request: Request):
-    username = get_user_session(request)
-    user_id = await database.fetch_val("SELECT id FROM users WHERE username = :u", {"u": username})
-    await database.execute("DELETE FROM messages WHERE chat_id = :cid", {"cid": chat_id})
-    await database.execute("DELETE FROM chat_memory WHERE chat_id = :cid", {"cid": chat_id})
-    await database.execute("DELETE FROM chat_summaries WHERE chat_id = :cid", {"cid": chat_id})
-    await database.execute("DELETE FROM chats WHERE id = :cid", {"cid": chat_id})
+    user_id = await get_session_user_id(request)
+    await chat_repository.delete_chat(chat_id, user_id)
 
+    # Waits out an in-flight save of the index, so off the event loop
+    await run_in_faiss_pool(index_manager.discard, chat_id)
     faiss_dir = f"faiss_indexes/chat_{chat_id}"
     if os.path.exists(faiss_dir):
         shutil.rmtree(faiss_dir)
     return {"success": True}
 
-from os import getenv
-from tasks import generate_response_task
-from celery.result import AsyncResult
-
-USE_CELERY = getenv("USE_CELERY", "false").lower() == "true"
+USE_CELERY = os.getenv("USE_CELERY", "false").lower() == "true"
 
 @router.post("/api/respond")
 async def respond(
@@ -125,112 +111,210 @@ async def respond(
     prompt: str = Form(...),
     model: str = Form(...),
     chat_id: int = Form(...),
-    file: UploadFile = File(None)
+    file: UploadFile = File(None),
+    stream: bool = Form(False)
 ):
     start_time = time.time()
-    username = get_user_session(request)
-    user_id = await database.fetch_val("SELECT id FROM users WHERE username = :u", {"u": username})
-    chat_owner = await database.fetch_val("SELECT user_id FROM chats WHERE id = :cid", {"cid": chat_id})
-    if chat_owner != user_id:
-        raise HTTPException(status_code=403, detail="Forbidden")
-
-    # Save user message
-    await database.execute(
-        "INSERT INTO messages (chat_id, role, content) VALUES (:cid, 'user', :msg)",
-        {"cid": chat_id, "msg": prompt}
-    )
-
-    # Build context
-    rows = await database.fetch_all("SELECT role, content FROM messages WHERE chat_id = :cid ORDER BY timestamp ASC", {"cid": chat_id})
-    messages = [dict(r) for r in rows]
-    summary = await database.fetch_val("SELECT summary FROM chat_summaries WHERE chat_id = :cid", {"cid": chat_id}) or ""
-    file_text = ""
+    deadline = Deadline(start=start_time)
+    user_id = await get_session_user_id(request)
+    with timed("load_chat"):
+        # Ownership, title and summary in one round trip
+        chat = await get_owned_chat(chat_id, user_id)
+
+        # Build context from the bounded history tail, read before the new prompt is stored
+        recent_messages = await chat_repository.fetch_recent_messages(chat_id, RECENT_HISTORY_MAX_MESSAGES)
+    with timed("persist"):
+        await chat_repository.save_user_message(chat_id, prompt)
+    summary = chat["summary"]
+    file_section = ""
     if file and file.filename.endswith(".pptx"):
         file_bytes = await file.read()
-        file_text = extract_text_from_pptx(file_bytes, file.filename)
-
-    retrieved = get_relevant_context(prompt, chat_id)
-    recent = "\n".join([
-        f"{m['role'].capitalize()}: {m['content']}"
-        for m in messages[-6:] if m['role'] == "assistant" or m['content'] != prompt
-    ])
-    file_section = f"File content:\n{file_text.strip()}" if file_text.strip() else ""
-
-    context_template = PromptTemplate.from_template("""
-        You are a helpful assistant. Respond naturally, without offering multiple options or conversational instructions.
-
-        Existing Chat Summary:
-        {summary}
-
-        Relevant Information:
-        {retrieved}
+        try:
+            # Index the deck once; later turns pull only the relevant slides via retrieval
+            with timed("ingest"):
+                chunk_count = await ingest_pptx(chat_id, file_bytes, file.filename)
+            file_section = (
+                f"Attached file '{file.filename}' has been indexed; its relevant slides are included under Relevant Information."
+                if chunk_count else f"The provided '{file.filename}' contained no extractable text."
+            )
+        except Exception as e:
+            logger.error(f"Indexing {file.filename} failed, falling back to raw text: {e}")
+            file_text = extract_text_from_pptx(file_bytes, file.filename)
+            file_section = f"File content:\n{file_text.strip()}" if file_text.strip() else ""
 
-        Recent Chat History:
-        {recent}
-
-        {file_section}
-
-        User: {prompt}
-        Assistant:""")
-    
-    trimmed = trim_context(summary, retrieved, recent, file_section, prompt, max_tokens=MODEL_TOKEN_LIMITS.get(model, 4096))
-    full_context = context_template.format_prompt(**trimmed).to_string()
+    try:
+        with timed("retrieval"):
+            retrieved = await aretrieve_context(prompt, chat_id)
+    except Exception as e:
+        logger.error(f"Error retrieving from FAISS: {e}")
+        retrieved = []
+
+    with timed("context_limit"):
+        context_limit = await get_context_limit(model)
+    with timed("packing"):
+        packed = pack_context(prompt, summary, retrieved, recent_messages, file_section, context_limit, model=model)
+        full_context = packed.render()
     logger.info(f"\n--- Prompt Context for Chat {chat_id} ---\n{full_context}\n----------------------------\n")
 
+    # Only turns with no chat-specific context (file, history, summary, retrieval) may share answers
+    cacheable = response_cache is not None and not (file_section or recent_messages or summary.strip() or retrieved)
+    cache_headers, prompt_embedding, store_response = {}, None, None
+    if cacheable:
+        if request.headers.get(RESPONSE_CACHE_BYPASS_HEADER):
+            response_cache.record_bypass()
+            cache_headers["X-Response-Cache"] = "bypass"
+        else:
+            with timed("cache_lookup"):
+                if response_cache.uses_embeddings:
+                    prompt_embedding = await embed_prompt(prompt)
+                cached = response_cache.get(model, prompt, prompt_embedding)
+            if cached is not None:
+                title = await finish_response(chat, chat_id, model, prompt, cached, start_time, cached=True)
+                cache_headers["X-Response-Cache"] = "hit"
+                if stream:
+                    return StreamingResponse(
+                        replay_response(chat_id, cached, title), media_type="application/x-ndjson", headers=cache_headers
+                    )
+                return JSONResponse({"response": cached, "chat_id": chat_id, "title": title}, headers=cache_headers)
+            cache_headers["X-Response-Cache"] = "miss"
+        store_response = lambda text: response_cache.put(model, prompt, text, prompt_embedding)
 
     # Use Celery if enabled
     if USE_CELERY:
-        task = generate_response_task.delay(model, full_context)
-        return {"task_id": task.id, "chat_id": chat_id, "title": await database.fetch_val("SELECT title FROM chats WHERE id = :cid", {"cid": chat_id})}
+        # The worker stores the reply and pushes progress to /api/task_events
+        with timed("enqueue"):
+            task = generate_response_task.apply_async(
+                (model, full_context, context_limit),
+                dict(chat_id=chat_id, prompt=prompt, enqueued_at=start_time, deadline_at=deadline.expires_at),
+                expires=deadline.remaining()  # still queued at the deadline: dropped unrun
+            )
+        return {"task_id": task.id, "chat_id": chat_id, "title": chat["title"]}
+
+    # Streamed direct call: relay tokens as NDJSON lines while Ollama generates
+    if stream:
+        # Admitted before the response starts, so an overloaded server can still answer 429
+        slot = await generation_admission.acquire(user_id, timeout=deadline.remaining())
+        return StreamingResponse(
+            stream_response(request, chat, chat_id, model, prompt, full_context, start_time, context_limit,
+                            deadline, store_response, slot),
+            media_type="application/x-ndjson",
+            headers=cache_headers,
+            background=BackgroundTask(slot.release)  # covers a client that leaves before the body starts
+        )
 
     # Else do direct call (local dev mode)
-    llm = get_llm(model)
-    response = await llm.ainvoke(full_context)
+    llm = get_llm(model, num_ctx=context_limit)
+    try:
+        async with generation_admission.slot(user_id, timeout=deadline.remaining()):
+            with timed("generation"):
+                # Stops Ollama if the client goes away or the deadline passes
+                response = await run_guarded(
+                    llm.ainvoke(full_context, affinity_key=chat_affinity_key(chat_id)), deadline, disconnect_probe(request)
+                )
+    except GenerationCancelled as e:
+        if e.reason == "deadline":
+            raise HTTPException(status_code=504, detail=DEADLINE_MESSAGE)
+        return Response(status_code=499)  # client closed the request; nobody reads this
     response = remove_think_tags(response)
+    if store_response:
+        store_response(response)
 
-    await database.execute(
-        "INSERT INTO messages (chat_id, role, content) VALUES (:cid, 'assistant', :msg)",
-        {"cid": chat_id, "msg": response}
-    )
+    return JSONResponse({
+        "response": response,
+        "chat_id": chat_id,
+        "title": await finish_response(chat, chat_id, model, prompt, response, start_time)
+    }, headers=cache_headers)
 
-    # Background title & summary
-    msg_count = await database.fetch_val("SELECT COUNT(*) FROM messages WHERE chat_id = :cid", {"cid": chat_id})
-    if msg_count == 2:
-        first_msg = messages[0]["content"]
-        generate_title_task.delay(chat_id, first_msg, model)
-    if msg_count >= 6 and msg_count % 6 == 0:
-        summarize_chat_task.delay(chat_id, model, messages)
+async def embed_prompt(prompt: str) -> Optional[List[float]]:
+    # Retrieval just embedded the same text, so this is normally an embedding-cache hit
+    try:
+        return (await get_embedding_model().aembed_documents([prompt]))[0]
+    except Exception as e:
+        logger.warning(f"Could not embed prompt for the response cache: {e}")
+        return None
 
-    elapsed_time = time.time() - start_time
-    response_time_logger.info(f"Chat {chat_id} | Model: {model} | Time: {elapsed_time:.2f}s")
+async def finish_response(chat: dict, chat_id: int, model: str, prompt: str, response: str, start_time: float, cached: bool = False):
+    with timed("persist"):
+        msg_count = await chat_repository.save_reply(chat_id, response)
 
-    return {
-        "response": response,
-        "chat_id": chat_id,
-        "title": await database.fetch_val("SELECT title FROM chats WHERE id = :cid", {"cid": chat_id})
-    }
+    # Background title & summary; the insert returned the count of answered messages
+    schedule_followups(chat_id, model, prompt, msg_count)
 
+    elapsed_time = time.time() - start_time
+    response_time_logger.info(f"Chat {chat_id} | Model: {model} | Time: {elapsed_time:.2f}s{' (cached)' if cached else ''}")
+    RESPONSE_SECONDS.labels("cache" if cached else "ollama").observe(elapsed_time)
+    if not cached:
+        # Cache hits never reach Ollama, so they say nothing about interactive load
+        await record_interactive_latency(elapsed_time)
+
+    return chat["title"]
+
+async def replay_response(chat_id: int, response: str, title: str):
+    yield json.dumps({"token": response}) + "\n"
+    yield json.dumps({"done": True, "chat_id": chat_id, "title": title}) + "\n"
+
+async def stream_response(request: Request, chat: dict, chat_id: int, model: str, prompt: str, full_context: str, start_time: float,
+                          context_limit: int, deadline: Deadline, store_response=None, slot=None):
+    llm = get_llm(model, num_ctx=context_limit)
+    think_filter = ThinkTagFilter()
+    parts, generation_start = [], time.perf_counter()
+    try:
+        tokens = llm.astream_tokens(full_context, affinity_key=chat_affinity_key(chat_id))
+        async for token in stream_guarded(tokens, deadline, disconnect_probe(request)):
+            text = think_filter.feed(token)
+            if text:
+                if not parts:
+                    first_token = time.time() - start_time
+                    TIME_TO_FIRST_TOKEN.labels(model).observe(first_token)
+                    response_time_logger.info(f"Chat {chat_id} | Model: {model} | First token: {first_token:.2f}s")
+                parts.append(text)
+                yield json.dumps({"token": text}) + "\n"
+        tail = think_filter.flush()
+        if tail:
+            parts.append(tail)
+            yield json.dumps({"token": tail}) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"error": e.detail}) + "\n"
+        return
+    except GenerationCancelled as e:
+        if e.reason == "deadline":
+            yield json.dumps({"error": DEADLINE_MESSAGE}) + "\n"
+        return
+    finally:
+        if slot is not None:
+            slot.release()
+    STAGE_SECONDS.labels("generation").observe(time.perf_counter() - generation_start)
+
+    response = "".join(parts).strip()
+    if store_response:
+        store_response(response)
+    title = await finish_response(chat, chat_id, model, prompt, response, start_time)
+    yield json.dumps({"done": True, "chat_id": chat_id, "title": title}) + "\n"
 
 
 @router.get("/api/chat_title")
 async def get_chat_title(chat_id: int, request: Request):
-    username = get_user_session(request)
-    user_id = await database.fetch_val("SELECT id FROM users WHERE username = :u", {"u": username})
-
-    chat_owner = await database.fetch_val("SELECT user_id FROM chats WHERE id = :cid", {"cid": chat_id})
-    if chat_owner != user_id:
+    user_id = await get_session_user_id(request)
+    chat = await database.fetch_one("SELECT user_id, title FROM chats WHERE id = :cid", {"cid": chat_id})
+    if chat is None or chat["user_id"] != user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    title = await database.fetch_val("SELECT title FROM chats WHERE id = :cid", {"cid": chat_id})
+    title = chat["title"]
     if not title:
         raise HTTPException(status_code=404, detail="Chat not found")
     
     return {"title": title}
 
 @router.get("/api/shared_chat_history")
-async def shared_chat_history(chat_id: int):
+async def shared_chat_history(chat_id: int, limit: Optional[int] = None, before: Optional[int] = None):
+    if limit is not None or before is not None:
+        page = await chat_repository.fetch_history_page(chat_id, limit, before)
+        if not page["messages"] and before is None:
+            raise HTTPException(status_code=404, detail="Chat not found")
+        return page
+
     rows = await database.fetch_all(
-        "SELECT role, content FROM messages WHERE chat_id = :chat_id ORDER BY timestamp ASC",
+        "SELECT role, content FROM messages WHERE chat_id = :chat_id ORDER BY timestamp ASC, id ASC",
         {"chat_id": chat_id}
     )
     if not rows:
@@ -239,14 +323,7 @@ async def shared_chat_history(chat_id: int):
 
 @router.post("/api/rename_chat")
 async def rename_chat(req: RenameChatRequest, request: Request):
-    username = get_user_session(request)
-
-    user_id = await database.fetch_val(
-        "SELECT id FROM users WHERE username = :username",
-        {"username": username}
-    )
-    if not user_id:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_id = await get_session_user_id(request)
 
     result = await database.execute(
         "UPDATE chats SET title = :title WHERE id = :chat_id AND user_id = :user_id",
@@ -255,6 +332,52 @@ async def rename_chat(req: RenameChatRequest, request: Request):
     return {"success": True}
 
 
+@router.get("/api/task_events")
+async def task_events(task_id: str, chat_id: int, request: Request):
+    """Server-sent events for a Celery generation: partial tokens, then one
+    done (with the full response) or error event."""
+    user_id = await get_session_user_id(request)
+    chat_owner = await database.fetch_val("SELECT user_id FROM chats WHERE id = :cid", {"cid": chat_id})
+    if chat_owner != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    async def event_stream():
+        finished = False
+        try:
+            async for event in subscribe_events(task_id):
+                if event.get("keepalive"):
+                    yield ": keepalive\n\n"
+                    continue
+                finished = is_final(event)
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            if not finished:
+                # The client left mid-generation; stop the worker unless it comes back
+                run_in_background(cancel_abandoned_task(task_id))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/api/cancel_task")
+async def cancel_task(task_id: str, chat_id: int, request: Request):
+    user_id = await get_session_user_id(request)
+    chat_owner = await database.fetch_val("SELECT user_id FROM chats WHERE id = :cid", {"cid": chat_id})
+    if chat_owner != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    await cancel_response_task(task_id, "user_cancel")
+    return {"success": True}
+
+@router.get("/api/cache_stats")
+async def cache_stats(request: Request):
+    await get_session_user_id(request)
+    return {
+        "response_cache": response_cache.stats() if response_cache is not None else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+    }
+
 @router.get("/api/task_status")
 async def task_status(task_id: str):
     result = AsyncResult(task_id)
@@ -0,0 +1,190 @@
+# context_builder.py
+import os
+import time
+import logging
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from http_client import get_http_session
+from ollama_pool import ollama_pool
+from tokenizer import get_encoding, token_counts
+
+logger = logging.getLogger(__name__)
+
+# ---- Model limits (single source) ----
+# Fallbacks for when Ollama's /api/show can't be reached or has no context length
+MODEL_TOKEN_LIMITS = {
+    "gemma:2b": 8192, "gemma:7b": 8192, "gemma:1.1b": 8192, "gemma3": 32768,
+    "mistral": 8192, "mistral:7b": 8192,
+    "llama3": 8192, "llama3:8b": 8192, "llama3:70b": 8192, "llama2": 4096, "llama2:7b": 4096,
+    "deepseek:1.3b": 8192, "phi3:3b": 8192, "phi": 2048, "tinyllama": 2048,
+    "mixtral": 32768, "dolphin-mixtral": 32768,
+    "default": 4096
+}
+
+# Caps the window we pack for (and ask Ollama to allocate via num_ctx); 0 disables the cap
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))
+CONTEXT_RESERVED_OUTPUT_TOKENS = int(os.getenv("CONTEXT_RESERVED_OUTPUT_TOKENS", "512"))
+MODEL_INFO_RETRY_SECONDS = 60
+RECENT_HISTORY_MAX_MESSAGES = int(os.getenv("RECENT_HISTORY_MAX_MESSAGES", "20"))
+
+# Share of the section budget each section gets before leftovers are redistributed
+SECTION_SHARES = {"retrieved": 0.35, "recent": 0.35, "summary": 0.2, "file_section": 0.1}
+# Order in which sections claim leftover budget
+SECTION_PRIORITY = ["recent", "summary", "retrieved", "file_section"]
+
+# Ordered from most to least stable across turns of a chat (instructions, the
+# summary, append-only history, then per-turn file and retrieval text) so that
+# Ollama can reuse the KV cache for the longest possible prompt prefix.
+CONTEXT_TEMPLATE = """
+        You are a helpful assistant. Respond naturally, without offering multiple options or conversational instructions.
+
+        Existing Chat Summary:
+        {summary}
+
+        Recent Chat History:
+        {recent}
+
+        {file_section}
+
+        Relevant Information:
+        {retrieved}
+
+        User: {prompt}
+        Assistant:"""
+
+def table_token_limit(model: str) -> int:
+    model = model.lower()
+    if model in MODEL_TOKEN_LIMITS:
+        return MODEL_TOKEN_LIMITS[model]
+    matches = [k for k in MODEL_TOKEN_LIMITS if k != "default" and k in model]
+    return MODEL_TOKEN_LIMITS[max(matches, key=len)] if matches else MODEL_TOKEN_LIMITS["default"]
+
+_model_limits: Dict[str, int] = {}
+_model_limit_failures: Dict[str, float] = {}
+
+async def fetch_model_context_length(model: str) -> Optional[int]:
+    for node in ollama_pool.healthy_nodes():
+        try:
+            async with get_http_session().post(
+                f"{node.base_url}/api/show", json={"model": model}, timeout=aiohttp.ClientTimeout(total=5)
+            ) as resp:
+                if resp.status != 200:
+                    continue
+                info = (await resp.json()).get("model_info", {})
+            lengths = [v for k, v in info.items() if k.endswith(".context_length")]
+            return int(lengths[0]) if lengths else None
+        except Exception as e:
+            logger.warning(f"Could not read model info for '{model}' from {node.base_url}: {e}")
+    return None
+
+async def get_context_limit(model: str) -> int:
+    limit = _model_limits.get(model)
+    if limit is None:
+        last_failure = _model_limit_failures.get(model)
+        if last_failure is None or time.monotonic() - last_failure >= MODEL_INFO_RETRY_SECONDS:
+            limit = await fetch_model_context_length(model)
+            if limit is None:
+                _model_limit_failures[model] = time.monotonic()
+            else:
+                _model_limits[model] = limit
+        if limit is None:
+            limit = table_token_limit(model)
+    return min(limit, OLLAMA_NUM_CTX) if OLLAMA_NUM_CTX > 0 else limit
+
+# ---- Packing ----
+class Section:
+    def __init__(self, items: List[tuple], contiguous: bool = False, truncatable: bool = False):
+        self.items = items  # (text, tokens) in the order they should be kept
+        self.contiguous = contiguous  # never skip an item to fit a later one
+        self.truncatable = truncatable  # an item that doesn't fit may be cut down on the final pass
+        self.kept: List[str] = []
+        self._next = 0
+
+    def fill(self, budget: int, encoding, final: bool = False) -> int:
+        spent = 0
+        while self._next < len(self.items):
+            text, tokens = self.items[self._next]
+            if spent + tokens <= budget:
+                self.kept.append(text)
+                spent += tokens
+                self._next += 1
+                continue
+            # Before the final pass, stop so leftover budget can still take this item whole
+            if not final or self.contiguous:
+                break
+            if self.truncatable and budget - spent > 0:
+                self.kept.append(encoding.decode(encoding.encode(text, disallowed_special=())[:budget - spent]))
+                spent = budget
+            self._next += 1
+        return spent
+
+class PackedContext:
+    def __init__(self, sections: Dict[str, str], used_tokens: int, context_limit: int, reserved_output: int):
+        self.sections = sections
+        self.used_tokens = used_tokens
+        self.context_limit = context_limit
+        self.reserved_output = reserved_output
+
+    def render(self) -> str:
+        return CONTEXT_TEMPLATE.format(**self.sections)
+
+def _count(text: str, model: str, key=None) -> int:
+    return token_counts.count(text, model, key=key)
+
+def pack_context(
+    prompt: str,
+    summary: str,
+    retrieved: List[str],
+    recent: List[dict],
+    file_section: str,
+    context_limit: int,
+    reserved_output: int = CONTEXT_RESERVED_OUTPUT_TOKENS,
+    model: str = "gpt-3.5-turbo",
+) -> PackedContext:
+    """Fit the prompt sections into context_limit - reserved_output tokens.
+
+    retrieved is ordered best-first and recent is chronological (dicts with id,
+    role and content). Each section first gets its proportional share, then
+    leftover budget goes to sections in SECTION_PRIORITY order. Recent history
+    is kept newest-first and contiguous; retrieval keeps whole chunks. Tokens
+    are counted with model's encoding.
+    """
+    encoding = get_encoding(model)
+    overhead = _count(CONTEXT_TEMPLATE.format(summary="", retrieved="", recent="", file_section="", prompt=""), model, key="template")
+    available = max(context_limit - reserved_output - overhead, 0)
+
+    prompt_tokens = len(encoding.encode(prompt, disallowed_special=()))
+    if prompt_tokens > available:
+        prompt = encoding.decode(encoding.encode(prompt, disallowed_special=())[:available])
+        prompt_tokens = available
+    available -= prompt_tokens
+
+    newest_first = []
+    for m in reversed(recent):
+        line = f"{m['role'].capitalize()}: {m['content']}"
+        # +1 for the joining newline; ("msg", id) always means this raw "Role: content" line
+        newest_first.append((line, _count(line, model, key=("msg", m["id"])) + 1))
+    sections = {
+        "summary": Section([(summary, _count(summary, model))] if summary.strip() else [], truncatable=True),
+        "retrieved": Section([(r, _count(r, model) + 1) for r in retrieved if r.strip()]),
+        "recent": Section(newest_first, contiguous=True),
+        "file_section": Section([(file_section, _count(file_section, model))] if file_section.strip() else [], truncatable=True),
+    }
+
+    remaining = available
+    for name, share in SECTION_SHARES.items():
+        remaining -= sections[name].fill(int(available * share), encoding)
+    for name in SECTION_PRIORITY:
+        remaining -= sections[name].fill(remaining, encoding, final=True)
+
+    used = available - remaining
+    rendered = {
+        "summary": sections["summary"].kept[0] if sections["summary"].kept else "",
+        "retrieved": "\n".join(sections["retrieved"].kept),
+        "recent": "\n".join(reversed(sections["recent"].kept)),
+        "file_section": sections["file_section"].kept[0] if sections["file_section"].kept else "",
+        "prompt": prompt,
+    }
+    return PackedContext(rendered, overhead + prompt_tokens + used, context_limit, reserved_output)
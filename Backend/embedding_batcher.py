@@ -0,0 +1,92 @@
+# embedding_batcher.py
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "10"))
+
+class EmbeddingBatcher:
+    """Micro-batches concurrent embedding requests into one upstream call.
+
+    Callers await embed(text); texts arriving within the batch window (or until
+    the batch is full) are sent together through embed_batch and the vectors
+    are handed back to each waiting caller. A text that is already part of an
+    in-flight batch joins it instead of being sent again.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        max_batch_size: int = EMBED_BATCH_MAX_SIZE,
+        window_ms: float = EMBED_BATCH_WINDOW_MS,
+    ):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000.0
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._in_flight: Dict[str, List[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.coalesced = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Futures are loop-bound; anything pending on an old loop is gone with it
+            self._loop, self._pending, self._in_flight, self._timer = loop, {}, {}, None
+        future = loop.create_future()
+        waiting = self._in_flight.get(text)
+        if waiting is not None:
+            self.coalesced += 1
+            waiting.append(future)
+            return await future
+        self._pending.setdefault(text, []).append(future)  # identical texts share a slot
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.embed(t) for t in texts)))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        self._in_flight.update(batch)
+        self._loop.create_task(self._run(batch))
+
+    async def _run(self, batch: Dict[str, List[asyncio.Future]]):
+        texts = list(batch)
+        try:
+            vectors = await self.embed_batch(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Embedding batch returned {len(vectors)} vectors for {len(texts)} inputs")
+        except Exception as e:
+            self._release(batch)
+            logger.error(f"Batched embedding request for {len(texts)} text(s) failed: {e}")
+            for futures in batch.values():
+                for f in futures:
+                    if not f.done():
+                        f.set_exception(e)
+            return
+        self._release(batch)
+        for text, vector in zip(texts, vectors):
+            for f in batch[text]:
+                if not f.done():
+                    f.set_result(vector)
+
+    def _release(self, batch: Dict[str, List[asyncio.Future]]):
+        # Joiners appended to these lists until now are answered with the batch
+        for text, futures in batch.items():
+            if self._in_flight.get(text) is futures:
+                del self._in_flight[text]
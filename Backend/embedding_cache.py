@@ -0,0 +1,199 @@
+# embedding_cache.py
+import os
+import re
+import glob
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+
+KEY_BYTES = 32  # sha256 digest
+# Part of every key; bump it when the stored vectors change meaning (2: L2-normalized)
+EMBEDDING_CACHE_VERSION = 2
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"v{EMBEDDING_CACHE_VERSION}\0{model}\0{text}".encode("utf-8")).digest()
+
+class DiskEmbeddingStore:
+    """Append-only file of fixed-size records (sha256 key + float32 vector).
+
+    Records are appended with a single O_APPEND write so several processes can
+    share one store; reads go through a numpy memmap that is refreshed when the
+    file grows. Calls block on file I/O, so async code runs them in a thread.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.dim: Optional[int] = None
+        self.path: Optional[str] = None
+        self._rows: Dict[bytes, int] = {}
+        self._indexed_bytes = 0
+        self._mmap = None
+        self._lock = threading.Lock()  # guards the row index and memmap
+        existing = sorted(glob.glob(os.path.join(directory, "vectors_*.f32")))
+        if existing:
+            self._open(int(re.search(r"vectors_(\d+)\.f32$", existing[-1]).group(1)))
+
+    def _open(self, dim: int):
+        self.dim = dim
+        self.path = os.path.join(self.directory, f"vectors_{dim}.f32")
+        self._dtype = np.dtype([("key", f"S{KEY_BYTES}"), ("vec", "<f4", (dim,))])
+        self._refresh()
+
+    def _refresh(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        count = size // self._dtype.itemsize
+        if count * self._dtype.itemsize <= self._indexed_bytes:
+            return
+        self._mmap = np.memmap(self.path, dtype=self._dtype, mode="r", shape=(count,))
+        start = self._indexed_bytes // self._dtype.itemsize
+        for row in range(start, count):
+            self._rows[bytes(self._mmap[row]["key"])] = row
+        self._indexed_bytes = count * self._dtype.itemsize
+
+    def get(self, key: bytes) -> Optional[List[float]]:
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                self._refresh()  # another process may have appended it
+                row = self._rows.get(key)
+            if row is None:
+                return None
+            return self._mmap[row]["vec"].tolist()
+
+    def put(self, key: bytes, vector: List[float]):
+        with self._lock:
+            if self.dim is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._open(len(vector))
+        if len(vector) != self.dim:
+            logger.warning(f"Skipping disk cache write: vector dim {len(vector)} != store dim {self.dim}")
+            return
+        record = np.zeros(1, dtype=self._dtype)
+        record["key"] = key
+        record["vec"] = vector
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record.tobytes())
+        finally:
+            os.close(fd)
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-memory LRU in front of a disk store.
+
+    The lock only covers the in-memory LRU; disk reads and writes happen
+    outside it. On the event loop use aget/aput, which do the disk I/O in a
+    thread (writes in the background).
+    """
+
+    def __init__(self, directory: str = EMBEDDING_CACHE_DIR, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._stores: Dict[str, DiskEmbeddingStore] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _store(self, model: str) -> DiskEmbeddingStore:
+        with self._lock:
+            store = self._stores.get(model)
+        if store is None:
+            # Opening indexes the existing file, so it happens outside the lock
+            safe = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+            store = DiskEmbeddingStore(os.path.join(self.directory, safe))
+            with self._lock:
+                store = self._stores.setdefault(model, store)
+        return store
+
+    def _remember(self, key: bytes, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _memory_get(self, key: bytes) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+            return vector
+
+    def _disk_get(self, model: str, key: bytes) -> Optional[List[float]]:
+        try:
+            vector = self._store(model).get(key)
+        except Exception as e:
+            logger.warning(f"Embedding disk cache read failed: {e}")
+            vector = None
+        with self._lock:
+            if vector is not None:
+                self._remember(key, vector)
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+        return vector
+
+    def _memory_put(self, key: bytes, vector: List[float]) -> bool:
+        # False if the vector was already cached (and so already on disk)
+        with self._lock:
+            if key in self._memory:
+                return False
+            self._remember(key, vector)
+            return True
+
+    def _disk_put(self, model: str, key: bytes, vector: List[float]):
+        try:
+            self._store(model).put(key, vector)
+        except Exception as e:
+            logger.warning(f"Embedding disk cache write failed: {e}")
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        vector = self._memory_get(key)
+        return vector if vector is not None else self._disk_get(model, key)
+
+    def put(self, model: str, text: str, vector: List[float]):
+        key = cache_key(model, text)
+        if self._memory_put(key, vector):
+            self._disk_put(model, key, vector)
+
+    async def aget(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        vector = self._memory_get(key)
+        if vector is not None:
+            return vector
+        return await asyncio.get_running_loop().run_in_executor(None, self._disk_get, model, key)
+
+    async def aput(self, model: str, text: str, vector: List[float]):
+        # The vector is served from memory at once; the append isn't waited for
+        key = cache_key(model, text)
+        if self._memory_put(key, vector):
+            asyncio.get_running_loop().run_in_executor(None, self._disk_put, model, key, vector)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._memory),
+            }
+
+embedding_cache = EmbeddingCache() if EMBEDDING_CACHE_ENABLED else None
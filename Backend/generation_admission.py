@@ -0,0 +1,181 @@
+# generation_admission.py
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Hashable, Optional
+
+from fastapi import HTTPException
+
+from ollama_pool import ollama_pool, OLLAMA_NODE_MAX_IN_FLIGHT
+from metrics import ADMISSION_REJECTED, timed
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+# Caps are per API process; per-node caps are also applied when picking a node
+GENERATION_MAX_IN_FLIGHT = int(os.getenv("GENERATION_MAX_IN_FLIGHT", "32"))
+GENERATION_MAX_PER_USER = int(os.getenv("GENERATION_MAX_PER_USER", "2"))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "64"))
+GENERATION_MAX_QUEUED_PER_USER = int(os.getenv("GENERATION_MAX_QUEUED_PER_USER", "4"))
+GENERATION_QUEUE_TIMEOUT = float(os.getenv("GENERATION_QUEUE_TIMEOUT", "30"))
+HOLD_TIME_ALPHA = 0.2
+
+class GenerationSlot:
+    """A granted generation; release() is idempotent so streamed replies can
+    release from both the body generator and the response's background task."""
+
+    def __init__(self, admission: "GenerationAdmission", user: Hashable):
+        self._admission = admission
+        self._loop = admission._loop
+        self.user = user
+        self.granted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._admission._release(self)
+
+class GenerationAdmission:
+    """Bounds the generations this process sends to Ollama.
+
+    Up to min(GENERATION_MAX_IN_FLIGHT, per-node cap x nodes) run at once and
+    each user may hold GENERATION_MAX_PER_USER of them. Everyone else waits
+    in a bounded queue served round-robin across users, so one heavy user
+    can't starve the rest. A full queue is rejected at once with 429 and a
+    wait past GENERATION_QUEUE_TIMEOUT with 503, both with Retry-After.
+    """
+
+    def __init__(self, max_in_flight: int = GENERATION_MAX_IN_FLIGHT, max_per_user: int = GENERATION_MAX_PER_USER,
+                 max_queue: int = GENERATION_MAX_QUEUE, max_queued_per_user: int = GENERATION_MAX_QUEUED_PER_USER,
+                 queue_timeout: float = GENERATION_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._running: Dict[Hashable, int] = {}
+        self._waiting: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.hold_time = 10.0  # EWMA of how long a slot is held, for Retry-After
+
+    @property
+    def capacity(self) -> int:
+        return max(min(self.max_in_flight, ollama_pool.capacity(OLLAMA_NODE_MAX_IN_FLIGHT)), 1)
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Waiters are loop-bound; a new loop (tests, reloads) starts empty
+            self._loop, self.in_flight, self._running, self._waiting = loop, 0, {}, OrderedDict()
+        return loop
+
+    def retry_after(self) -> int:
+        # Roughly how long until the queue ahead drains
+        return max(math.ceil(self.hold_time * (self.queued + 1) / self.capacity), 1)
+
+    def _reject(self, status: int, reason: str, detail: str):
+        ADMISSION_REJECTED.labels(reason).inc()
+        logger.warning(f"Generation rejected ({reason}): {self.in_flight} running, {self.queued} queued")
+        raise HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(self.retry_after())})
+
+    def _grant(self, user: Hashable) -> GenerationSlot:
+        self.in_flight += 1
+        self._running[user] = self._running.get(user, 0) + 1
+        return GenerationSlot(self, user)
+
+    def _can_run(self, user: Hashable) -> bool:
+        return self._running.get(user, 0) < self.max_per_user
+
+    async def acquire(self, user: Hashable, timeout: Optional[float] = None) -> GenerationSlot:
+        loop = self._bind_loop()
+        # Serve waiters first (capacity may have grown since the last release); whoever is
+        # still queued after that is at their per-user cap, so a free slot can go to this caller
+        self._dispatch()
+        if self.in_flight < self.capacity and self._can_run(user):
+            return self._grant(user)
+
+        if self.queued >= self.max_queue:
+            self._reject(429, "queue_full", "The server is busy. Please try again shortly.")
+        if len(self._waiting.get(user, ())) >= self.max_queued_per_user:
+            self._reject(429, "user_queue_full", "Too many requests in progress. Please wait for them to finish.")
+
+        wait = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+        waiter = loop.create_future()
+        self._waiting.setdefault(user, deque()).append(waiter)
+        with timed("admission_wait"):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), wait)
+            except asyncio.TimeoutError:
+                if not (waiter.done() and not waiter.cancelled()):
+                    self._forget(user, waiter)
+                    self._reject(503, "queue_timeout", "The server is busy. Please try again shortly.")
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    waiter.result().release()  # granted just as the caller went away
+                else:
+                    self._forget(user, waiter)
+                raise
+        return waiter.result()
+
+    @asynccontextmanager
+    async def slot(self, user: Hashable, timeout: Optional[float] = None):
+        slot = await self.acquire(user, timeout)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def _forget(self, user: Hashable, waiter: asyncio.Future):
+        waiter.cancel()
+        queue = self._waiting.get(user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiting[user]
+
+    def _release(self, slot: GenerationSlot):
+        if slot._loop is not self._loop:
+            return  # granted on a loop that has since been replaced
+        self.hold_time += HOLD_TIME_ALPHA * (time.monotonic() - slot.granted_at - self.hold_time)
+        self.in_flight = max(self.in_flight - 1, 0)
+        running = self._running.get(slot.user, 0) - 1
+        if running > 0:
+            self._running[slot.user] = running
+        else:
+            self._running.pop(slot.user, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        # Round-robin: serve the first user (in rotation order) allowed another slot, then move them to the back
+        while self.in_flight < self.capacity:
+            user = next((u for u in self._waiting if self._can_run(u)), None)
+            if user is None:
+                return
+            queue = self._waiting[user]
+            waiter = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+            if not waiter.done():
+                waiter.set_result(self._grant(user))
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "capacity": self.capacity,
+            "waiting_users": len(self._waiting),
+        }
+
+generation_admission = GenerationAdmission()
@@ -0,0 +1,87 @@
+# http_client.py
+import os
+import asyncio
+import logging
+from typing import Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+HTTP_POOL_LIMIT = int(os.getenv("OLLAMA_HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("OLLAMA_HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("OLLAMA_HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+
+# ---- Async client (FastAPI event loop) ----
+# One session per process, bound to the loop it was created on. The API and each
+# Celery worker process run a single persistent loop; a caller on another loop
+# (a script, a test's asyncio.run) replaces the session, and the old one is closed
+# on its own loop or, if that loop is already gone, dropped for the GC.
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _new_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(total=None, connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+def _retire_session():
+    global _session, _session_loop
+    session, loop = _session, _session_loop
+    _session, _session_loop = None, None
+    if session is None or session.closed:
+        return
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+    else:
+        logger.warning("Dropping an HTTP session whose event loop has ended without closing it")
+
+def get_http_session() -> aiohttp.ClientSession:
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session_loop is not loop:
+        _retire_session()
+    if _session is None or _session.closed:
+        _session, _session_loop = _new_session(), loop
+    return _session
+
+async def start_http_client():
+    if _session is None or _session.closed or _session_loop is not asyncio.get_running_loop():
+        get_http_session()
+        logger.info(f"Started shared Ollama HTTP client (limit={HTTP_POOL_LIMIT}, per_host={HTTP_POOL_LIMIT_PER_HOST})")
+
+async def close_http_client():
+    global _session, _session_loop, _sync_session
+    if _session_loop is asyncio.get_running_loop():
+        session, _session, _session_loop = _session, None, None
+        if not session.closed:
+            await session.close()
+    else:
+        _retire_session()
+    if _sync_session is not None:
+        _sync_session.close()
+        _sync_session = None
+
+# ---- Sync client (blocking callers: langchain sync paths, Celery tasks) ----
+_sync_session: Optional[requests.Session] = None
+
+def get_sync_session() -> requests.Session:
+    global _sync_session
+    if _sync_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_LIMIT, pool_maxsize=HTTP_POOL_LIMIT_PER_HOST)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sync_session = session
+    return _sync_session
+
+SYNC_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
@@ -0,0 +1,217 @@
+# index_manager.py
+import os
+import sys
+import asyncio
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from vector_store import get_faiss_index, save_faiss_index
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+FAISS_CACHE_MAX_INDEXES = int(os.getenv("FAISS_CACHE_MAX_INDEXES", "64"))
+FAISS_CACHE_MAX_BYTES = int(os.getenv("FAISS_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+FAISS_FLUSH_INTERVAL = float(os.getenv("FAISS_FLUSH_INTERVAL", "30"))
+FAISS_WORKERS = int(os.getenv("FAISS_WORKERS", "4"))
+
+# Bounded pool for CPU-bound FAISS work (loads, inserts, searches) off the event loop
+_faiss_executor = ThreadPoolExecutor(max_workers=FAISS_WORKERS, thread_name_prefix="faiss")
+
+async def run_in_faiss_pool(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_faiss_executor, functools.partial(fn, *args, **kwargs))
+
+def estimate_index_bytes(index) -> int:
+    # Flat FAISS index: ntotal float32 vectors of dimension d, plus the docstore text
+    size = index.index.ntotal * index.index.d * 4
+    for doc in getattr(index.docstore, "_dict", {}).values():
+        size += sys.getsizeof(doc.page_content)
+    return size
+
+class IndexEntry:
+    def __init__(self, index):
+        self.index = index
+        self.dirty = False
+        self.nbytes = estimate_index_bytes(index)
+        self.lock = threading.Lock()  # serializes writes to the index and saves of it
+
+class VectorIndexManager:
+    """LRU cache of per-chat FAISS indexes with write-behind persistence.
+
+    Requests only mutate the in-memory index and mark it dirty; dirty indexes
+    are written to disk by the background flusher, on eviction and at shutdown.
+    An evicted index is saved on the FAISS pool right away and stays parked
+    (and counted against max_bytes) until that save succeeds.
+    """
+
+    def __init__(self, max_indexes: int = FAISS_CACHE_MAX_INDEXES, max_bytes: int = FAISS_CACHE_MAX_BYTES):
+        self.max_indexes = max_indexes
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, IndexEntry]" = OrderedDict()
+        # Evicted while dirty; kept until saved so a reload never sees stale disk state
+        self._evicted: Dict[int, IndexEntry] = {}
+        self._lock = threading.RLock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _touch(self, chat_id: int, loaded: Optional[IndexEntry] = None) -> Optional[IndexEntry]:
+        with self._lock:
+            entry = self._entries.get(chat_id) or self._evicted.pop(chat_id, None) or loaded
+            if entry is not None:
+                self._entries[chat_id] = entry
+                self._entries.move_to_end(chat_id)
+                self._evict()
+            return entry
+
+    def _entry(self, chat_id: int) -> IndexEntry:
+        entry = self._touch(chat_id)
+        if entry is None:
+            # Load outside the manager lock so other chats aren't blocked on disk I/O
+            entry = self._touch(chat_id, IndexEntry(get_faiss_index(chat_id)))
+        return entry
+
+    @contextmanager
+    def _writable(self, chat_id: int):
+        # Yields the chat's registered entry with its lock held. Eviction skips locked
+        # entries, and one evicted between _entry() and taking the lock is looked up
+        # again, so a write never lands on an entry nobody will flush.
+        while True:
+            entry = self._entry(chat_id)
+            with entry.lock:
+                with self._lock:
+                    current = self._entries.get(chat_id) is entry
+                if current:
+                    yield entry
+                    return
+
+    def get(self, chat_id: int):
+        return self._entry(chat_id).index
+
+    def add_documents(self, chat_id: int, documents: List):
+        with self._writable(chat_id) as entry:
+            entry.index.add_documents(documents)
+            self._mark_dirty(entry)
+
+    def add_embeddings(self, chat_id: int, documents: List, embeddings: List[List[float]]):
+        # Same as add_documents, for callers that already have the vectors
+        with self._writable(chat_id) as entry:
+            entry.index.add_embeddings(
+                [(d.page_content, e) for d, e in zip(documents, embeddings)],
+                metadatas=[d.metadata for d in documents],
+            )
+            self._mark_dirty(entry)
+
+    def search_by_vector(self, chat_id: int, embedding: List[float], k: int = 5, fetch_k: int = 15, lambda_mult: float = 0.7):
+        entry = self._entry(chat_id)
+        with entry.lock:
+            return entry.index.max_marginal_relevance_search_by_vector(
+                embedding, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+            )
+
+    def count_documents(self, chat_id: int, **metadata) -> int:
+        entry = self._entry(chat_id)
+        with entry.lock:
+            return sum(
+                1 for doc in entry.index.docstore._dict.values()
+                if all(doc.metadata.get(k) == v for k, v in metadata.items())
+            )
+
+    def _mark_dirty(self, entry: IndexEntry):
+        entry.dirty = True
+        entry.nbytes = estimate_index_bytes(entry.index)
+        with self._lock:
+            self._evict()
+
+    def discard(self, chat_id: int):
+        # Drop without saving, e.g. when the chat itself is deleted
+        with self._lock:
+            entries = [self._entries.pop(chat_id, None), self._evicted.pop(chat_id, None)]
+        for entry in entries:
+            if entry is not None:
+                with entry.lock:  # waits out an in-progress save
+                    entry.dirty = False
+
+    def _total_bytes(self) -> int:
+        # Parked entries are still in memory until their save finishes
+        return sum(e.nbytes for e in self._entries.values()) + sum(e.nbytes for e in self._evicted.values())
+
+    def _over_budget(self) -> bool:
+        return len(self._entries) > 1 and (
+            len(self._entries) > self.max_indexes or self._total_bytes() > self.max_bytes
+        )
+
+    def _evict(self):
+        # Least recently used first; entries being written or saved are skipped
+        for chat_id in list(self._entries):
+            if not self._over_budget():
+                return
+            entry = self._entries[chat_id]
+            if not entry.lock.acquire(blocking=False):
+                continue
+            dirty = entry.dirty
+            try:
+                del self._entries[chat_id]
+                if dirty:
+                    self._evicted[chat_id] = entry
+                    _faiss_executor.submit(self._try_save, chat_id, entry)
+            finally:
+                entry.lock.release()
+            logger.info(f"Evicted FAISS index for chat {chat_id} from memory (dirty={dirty})")
+
+    # ---- Persistence ----
+    def _save(self, chat_id: int, entry: IndexEntry):
+        with entry.lock:
+            if not entry.dirty:
+                return
+            entry.dirty = False
+            try:
+                save_faiss_index(entry.index, chat_id)
+            except Exception:
+                entry.dirty = True
+                raise
+
+    def _try_save(self, chat_id: int, entry: IndexEntry):
+        try:
+            self._save(chat_id, entry)
+        except Exception as e:
+            # Stays dirty (and parked, if evicted); the flusher retries it
+            logger.error(f"Background save of FAISS index for chat {chat_id} failed: {e}")
+            return
+        with self._lock:
+            if self._evicted.get(chat_id) is entry and not entry.dirty:
+                del self._evicted[chat_id]
+
+    def flush(self):
+        with self._lock:
+            pending = [(cid, e) for cid, e in self._entries.items() if e.dirty]
+            evicted = list(self._evicted.items())
+        for chat_id, entry in pending + evicted:
+            self._try_save(chat_id, entry)
+        if pending or evicted:
+            logger.info(f"Flushed {len(pending) + len(evicted)} FAISS index(es) to disk")
+
+    async def _flush_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await run_in_faiss_pool(self.flush)
+
+    def start_flusher(self, interval: float = FAISS_FLUSH_INTERVAL):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop(interval))
+
+    async def stop_flusher(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await run_in_faiss_pool(self.flush)
+
+index_manager = VectorIndexManager()
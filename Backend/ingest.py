@@ -0,0 +1,61 @@
+# ingest.py
+import io
+import os
+import hashlib
+import logging
+from typing import List, Tuple
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from vector_store import get_embedding_model
+from index_manager import index_manager, run_in_faiss_pool
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "800"))
+INGEST_CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "100"))
+
+_splitter = RecursiveCharacterTextSplitter(chunk_size=INGEST_CHUNK_SIZE, chunk_overlap=INGEST_CHUNK_OVERLAP)
+
+def extract_slides_from_pptx(file_bytes: bytes) -> List[Tuple[int, str]]:
+    from pptx import Presentation  # only needed for uploads; slow to import
+    prs = Presentation(io.BytesIO(file_bytes))
+    slides = []
+    for number, slide in enumerate(prs.slides, start=1):
+        text = "\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text") and shape.text.strip())
+        if text.strip():
+            slides.append((number, text))
+    return slides
+
+def chunk_slides(slides: List[Tuple[int, str]], filename: str, file_hash: str) -> List[Document]:
+    docs = []
+    for number, text in slides:
+        for chunk in _splitter.split_text(text):
+            docs.append(Document(
+                page_content=f"[{filename}, slide {number}]\n{chunk}",
+                metadata={"source": filename, "slide": number, "file_hash": file_hash},
+            ))
+    return docs
+
+async def ingest_pptx(chat_id: int, file_bytes: bytes, filename: str) -> int:
+    """Chunk a deck by slide, embed the chunks in batches and add them to the
+    chat's FAISS index. Re-uploading the same file is a no-op.
+
+    Returns the number of chunks indexed for the file.
+    """
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    existing = await run_in_faiss_pool(index_manager.count_documents, chat_id, file_hash=file_hash)
+    if existing:
+        logger.info(f"'{filename}' already indexed for chat {chat_id} ({existing} chunks)")
+        return existing
+
+    slides = await run_in_faiss_pool(extract_slides_from_pptx, file_bytes)
+    docs = chunk_slides(slides, filename, file_hash)
+    if not docs:
+        return 0
+    embeddings = await get_embedding_model().aembed_documents([d.page_content for d in docs])
+    await run_in_faiss_pool(index_manager.add_embeddings, chat_id, docs, embeddings)
+    logger.info(f"Indexed '{filename}' for chat {chat_id}: {len(slides)} slides, {len(docs)} chunks")
+    return len(docs)
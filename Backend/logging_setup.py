@@ -0,0 +1,52 @@
+# logging_setup.py
+import os
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+RESPONSE_TIME_LOG = os.getenv("RESPONSE_TIME_LOG", "logs/response_times.log")
+
+_listeners = []
+
+def install_queue_logging(logger: logging.Logger) -> None:
+    """Put the logger's handlers behind a queue drained by a background
+    thread, so request paths never block on file or console writes."""
+    handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+    if not handlers:
+        return
+    log_queue = queue.SimpleQueue()
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+def setup_response_time_log(path: str = RESPONSE_TIME_LOG) -> logging.Logger:
+    """Send the "response_time" logger to its own file. Called by the API at
+    startup rather than on import, so workers and scripts get no log files."""
+    logger = logging.getLogger("response_time")
+    logger.setLevel(logging.INFO)
+    if not any(isinstance(h, QueueHandler) for h in logger.handlers):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        logger.addHandler(handler)
+        install_queue_logging(logger)
+    return logger
+
+def stop_queue_logging():
+    # Drains what is queued, then joins the threads
+    while _listeners:
+        _listeners.pop().stop()
+
+def _restart_after_fork():
+    # Threads don't survive fork (Celery prefork children); records queued in the child need a new one
+    for i, listener in enumerate(_listeners):
+        _listeners[i] = QueueListener(listener.queue, *listener.handlers,
+                                      respect_handler_level=listener.respect_handler_level)
+        _listeners[i].start()
+
+atexit.register(stop_queue_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
@@ -1,16 +1,27 @@
 # main.py
+import time
+_import_start = time.perf_counter()
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
 from auth_routes import router as auth_router
 from chat_routes import router as chat_router
 from utils import database  # Updated to use PostgreSQL with asyncpg
+from migrations import run_migrations
+from http_client import start_http_client, close_http_client
+from ollama_pool import ollama_pool
+from index_manager import index_manager
+from task_events import close_redis
+from metrics import render_metrics, startup_phase, STARTUP_SECONDS, METRICS_CONTENT_TYPE
+from logging_setup import install_queue_logging, setup_response_time_log
+from warmup import warmup
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
+STARTUP_SECONDS.labels("api", "import").observe(time.perf_counter() - _import_start)
 
 app = FastAPI()
 
@@ -21,6 +32,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
 app.add_middleware(
@@ -35,11 +47,30 @@ app.add_middleware(
 app.include_router(auth_router)
 app.include_router(chat_router)
 
+@app.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 # --- Startup / Shutdown ---
 @app.on_event("startup")
 async def startup():
-    await database.connect()
+    # Pools are opened here, once; requests are accepted only after warmup.
+    # Logging moves behind its queue here too, so importing the app starts no threads or log files.
+    install_queue_logging(logging.getLogger())
+    setup_response_time_log()
+    with startup_phase("api", "database"):
+        await database.connect()
+    with startup_phase("api", "migrations"):
+        await run_migrations(database)
+    await start_http_client()
+    await warmup("api")
+    ollama_pool.start_health_checks()
+    index_manager.start_flusher()
 
 @app.on_event("shutdown")
 async def shutdown():
+    await ollama_pool.stop_health_checks()
+    await index_manager.stop_flusher()
+    await close_http_client()
+    await close_redis()
     await database.disconnect()
@@ -0,0 +1,196 @@
+# metrics.py
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+from prometheus_client import (
+    REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_revoked, worker_process_shutdown
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+# Set (to an empty, shared directory) when the API runs several processes or
+# Celery workers share the host: every process then writes its samples there
+# and /metrics aggregates them. Snapshot gauges (pool, caches) are per process.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+RATE_BUCKETS = (1, 2.5, 5, 10, 20, 40, 80, 160, 320)
+
+# ---- Histograms / counters ----
+STAGE_SECONDS = Histogram(
+    "chatbot_stage_seconds", "Time spent in each stage of a reply", ["stage"], buckets=LATENCY_BUCKETS
+)
+RESPONSE_SECONDS = Histogram(
+    "chatbot_response_seconds", "End-to-end reply latency", ["source"], buckets=LATENCY_BUCKETS
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "chatbot_time_to_first_token_seconds", "Request start to the first streamed token", ["model"], buckets=LATENCY_BUCKETS
+)
+OLLAMA_REQUEST_SECONDS = Histogram(
+    "chatbot_ollama_request_seconds", "Ollama generate requests per node", ["node", "kind", "outcome"], buckets=LATENCY_BUCKETS
+)
+OLLAMA_FIRST_TOKEN = Histogram(
+    "chatbot_ollama_first_token_seconds", "Upstream time to first token per node", ["node"], buckets=LATENCY_BUCKETS
+)
+OLLAMA_PROMPT_EVAL_SECONDS = Histogram(
+    "chatbot_ollama_prompt_eval_seconds", "Prompt processing time reported by Ollama", ["model"], buckets=LATENCY_BUCKETS
+)
+TOKENS_PER_SECOND = Histogram(
+    "chatbot_generation_tokens_per_second", "Decode rate reported by Ollama", ["model"], buckets=RATE_BUCKETS
+)
+GENERATED_TOKENS = Counter("chatbot_generated_tokens", "Tokens generated by Ollama", ["model"])
+EMBED_BATCH_SECONDS = Histogram(
+    "chatbot_embedding_batch_seconds", "Ollama /api/embed round trips", buckets=LATENCY_BUCKETS
+)
+EMBED_BATCH_SIZE = Histogram(
+    "chatbot_embedding_batch_size", "Texts per /api/embed request", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+ADMISSION_REJECTED = Counter(
+    "chatbot_admission_rejected", "Generations turned away by admission control", ["reason"]
+)
+GENERATIONS_CANCELLED = Counter(
+    "chatbot_generations_cancelled", "Generations stopped before they finished", ["reason"]
+)
+STARTUP_SECONDS = Histogram(
+    "chatbot_startup_seconds", "Time spent in each startup phase", ["process", "phase"], buckets=LATENCY_BUCKETS
+)
+CELERY_TASK_SECONDS = Histogram(
+    "chatbot_celery_task_seconds", "Celery task run time", ["task", "state"], buckets=LATENCY_BUCKETS
+)
+CELERY_QUEUE_WAIT = Histogram(
+    "chatbot_celery_queue_wait_seconds", "Publish to start of a Celery task", ["task"], buckets=LATENCY_BUCKETS
+)
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+@contextmanager
+def startup_phase(process: str, phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STARTUP_SECONDS.labels(process, phase).observe(elapsed)
+        logger.info(f"Startup ({process}): {phase} took {elapsed:.2f}s")
+
+def observe_generation(model: str, final_chunk: dict):
+    # Ollama's last chunk carries its own timings (durations in nanoseconds)
+    eval_count, eval_duration = final_chunk.get("eval_count"), final_chunk.get("eval_duration")
+    if eval_count and eval_duration:
+        GENERATED_TOKENS.labels(model).inc(eval_count)
+        TOKENS_PER_SECOND.labels(model).observe(eval_count / (eval_duration / 1e9))
+    if final_chunk.get("prompt_eval_duration"):
+        OLLAMA_PROMPT_EVAL_SECONDS.labels(model).observe(final_chunk["prompt_eval_duration"] / 1e9)
+
+# ---- Snapshot gauges ----
+class SnapshotCollector:
+    """Reads the in-process pool and cache state at scrape time."""
+
+    def describe(self):
+        # Nothing to check up front; collect() imports modules that import this one
+        return []
+
+    def collect(self):
+        from ollama_pool import ollama_pool
+        from response_cache import response_cache
+        from embedding_cache import embedding_cache
+        from tokenizer import token_counts
+        from utils import database, llm_flights
+        from generation_admission import generation_admission
+
+        in_flight = GaugeMetricFamily("chatbot_ollama_node_in_flight", "Requests in flight per Ollama node", labels=["node"])
+        healthy = GaugeMetricFamily("chatbot_ollama_node_healthy", "1 if the node is in rotation", labels=["node"])
+        latency = GaugeMetricFamily("chatbot_ollama_node_latency_seconds", "EWMA request latency per node", labels=["node"])
+        for node in ollama_pool.snapshot():
+            in_flight.add_metric([node["base_url"]], node["in_flight"])
+            healthy.add_metric([node["base_url"]], int(node["healthy"]))
+            latency.add_metric([node["base_url"]], node["latency"])
+        yield from (in_flight, healthy, latency)
+
+        hits = CounterMetricFamily("chatbot_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("chatbot_cache_misses", "Cache misses", labels=["cache"])
+        hit_rate = GaugeMetricFamily("chatbot_cache_hit_rate", "Hits over lookups", labels=["cache"])
+        caches = {"token_count": {"hits": token_counts.hits, "misses": token_counts.misses}}
+        if response_cache is not None:
+            stats = response_cache.stats()
+            caches["response"] = {"hits": stats["hits"] + stats["semantic_hits"], "misses": stats["misses"]}
+        if embedding_cache is not None:
+            stats = embedding_cache.stats()
+            caches["embedding"] = {"hits": stats["hits"] + stats["disk_hits"], "misses": stats["misses"]}
+        for name, stats in caches.items():
+            lookups = stats["hits"] + stats["misses"]
+            hits.add_metric([name], stats["hits"])
+            misses.add_metric([name], stats["misses"])
+            hit_rate.add_metric([name], stats["hits"] / lookups if lookups else 0.0)
+        yield from (hits, misses, hit_rate)
+
+        admission = generation_admission.stats()
+        yield GaugeMetricFamily("chatbot_admission_in_flight", "Generations admitted and running", value=admission["in_flight"])
+        yield GaugeMetricFamily("chatbot_admission_queued", "Generations waiting for a slot", value=admission["queued"])
+        yield GaugeMetricFamily("chatbot_admission_capacity", "Generations allowed at once", value=admission["capacity"])
+
+        flights = llm_flights.stats()
+        yield CounterMetricFamily("chatbot_llm_coalesced", "LLM calls served by an identical in-flight call", value=flights["coalesced"])
+
+        # asyncpg pool occupancy; in_use at max means queries are waiting for a connection
+        pool = getattr(database._backend, "_pool", None)
+        if pool is not None:
+            size = GaugeMetricFamily("chatbot_db_pool_connections", "DB pool connections", labels=["state"])
+            size.add_metric(["in_use"], pool.get_size() - pool.get_idle_size())
+            size.add_metric(["idle"], pool.get_idle_size())
+            size.add_metric(["max"], pool.get_max_size())
+            yield size
+
+_snapshots = SnapshotCollector()
+REGISTRY.register(_snapshots)
+
+def render_metrics() -> bytes:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(_snapshots)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+# ---- Celery hooks ----
+_task_starts = {}
+
+@before_task_publish.connect
+def _stamp_publish_time(headers=None, **kwargs):
+    if headers is not None:
+        headers["published_at"] = time.time()
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    _task_starts[task_id] = time.perf_counter()
+    published_at = getattr(task.request, "published_at", None)
+    if published_at:
+        CELERY_QUEUE_WAIT.labels(task.name).observe(max(time.time() - published_at, 0.0))
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    start = _task_starts.pop(task_id, None)
+    if start is not None:
+        CELERY_TASK_SECONDS.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - start)
+
+@task_revoked.connect
+def _task_revoked(request=None, expired=False, **kwargs):
+    # Discarded before running: past its deadline, or cancelled while still queued
+    GENERATIONS_CANCELLED.labels("expired" if expired else "revoked").inc()
+
+@worker_process_shutdown.connect
+def _mark_process_dead(pid=None, **kwargs):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid or os.getpid())
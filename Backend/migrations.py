@@ -0,0 +1,91 @@
+# migrations.py
+import os
+import re
+import json
+import logging
+from typing import List, Optional, Tuple
+
+from databases import Database
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Arbitrary constant so concurrent app/worker startups don't apply migrations twice
+MIGRATION_LOCK_ID = 7_351_002
+
+_FILENAME = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+def discover_migrations(directory: str = MIGRATIONS_DIR) -> List[Tuple[int, str, str]]:
+    """(version, name, path) for every NNNN_name.sql file, in version order."""
+    found = []
+    for filename in os.listdir(directory):
+        match = _FILENAME.match(filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    found.sort()
+    versions = [v for v, _, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {directory}")
+    return found
+
+async def run_migrations(database: Database, directory: str = MIGRATIONS_DIR) -> List[int]:
+    """Apply pending migrations, each in its own transaction. Returns the versions applied."""
+    applied_now = []
+    async with database.connection() as connection:
+        raw = connection.raw_connection  # asyncpg: needed for multi-statement scripts
+        await raw.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            await raw.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                  version INTEGER PRIMARY KEY,
+                  name TEXT NOT NULL,
+                  applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            applied = {r["version"] for r in await raw.fetch("SELECT version FROM schema_migrations")}
+            for version, name, path in discover_migrations(directory):
+                if version in applied:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    sql = f.read()
+                async with raw.transaction():
+                    await raw.execute(sql)
+                    await raw.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+                    )
+                logger.info(f"Applied migration {version:04d}_{name}")
+                applied_now.append(version)
+        finally:
+            await raw.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    return applied_now
+
+# ---- Query plans ----
+async def explain(database: Database, query: str, values: Optional[dict] = None, force_index: bool = False) -> dict:
+    """EXPLAIN (FORMAT JSON) for a query written the way the app runs it.
+
+    On small tables the planner rightly prefers a sequential scan, so tests
+    pass force_index=True to check that an index *can* serve the query.
+    """
+    async with database.transaction(force_rollback=True):
+        if force_index:
+            await database.execute("SET LOCAL enable_seqscan = off")
+        plan = await database.fetch_val(f"EXPLAIN (FORMAT JSON) {query}", values or {})
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return plan[0]["Plan"]
+
+def plan_nodes(plan: dict) -> List[dict]:
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+def plan_uses_index(plan: dict, index_name: str) -> bool:
+    return any(node.get("Index Name") == index_name for node in plan_nodes(plan))
+
+def plan_has_seq_scan(plan: dict, table: str) -> bool:
+    return any(
+        node.get("Node Type") == "Seq Scan" and node.get("Relation Name") == table
+        for node in plan_nodes(plan)
+    )
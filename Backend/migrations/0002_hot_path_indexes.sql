@@ -0,0 +1,10 @@
+-- Chat history, recent-context and summary queries: WHERE chat_id = ? ORDER BY timestamp, id
+CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp_id
+  ON messages (chat_id, timestamp, id);
+
+-- Sidebar chat list: WHERE user_id = ? ORDER BY created_at DESC
+CREATE INDEX IF NOT EXISTS idx_chats_user_created_at
+  ON chats (user_id, created_at DESC);
+
+-- Login matches username OR email; both are covered by their UNIQUE indexes,
+-- which the planner combines with a BitmapOr.
@@ -0,0 +1,20 @@
+-- Databases created before the foreign keys declared ON DELETE CASCADE still
+-- need it, so deleting a chat removes its messages, memory and summary.
+DO $$
+DECLARE
+  fk RECORD;
+BEGIN
+  FOR fk IN
+    SELECT c.conname, c.conrelid::regclass AS tbl, c.confrelid::regclass AS ref,
+           a.attname AS col
+    FROM pg_constraint c
+    JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+    WHERE c.contype = 'f'
+      AND c.confdeltype <> 'c'
+      AND c.conrelid::regclass::text IN ('chats', 'messages', 'chat_memory', 'chat_summaries')
+  LOOP
+    EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', fk.tbl, fk.conname);
+    EXECUTE format('ALTER TABLE %s ADD CONSTRAINT %I FOREIGN KEY (%I) REFERENCES %s(id) ON DELETE CASCADE',
+                   fk.tbl, fk.conname, fk.col, fk.ref);
+  END LOOP;
+END $$;
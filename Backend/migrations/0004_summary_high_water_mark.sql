@@ -0,0 +1,4 @@
+-- Id of the last message folded into chat_summaries.summary; summarization
+-- only reads messages after it.
+ALTER TABLE chat_summaries
+  ADD COLUMN IF NOT EXISTS summarized_through INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,10 @@
+-- Messages in answered turns, bumped by the insert that stores each reply so
+-- /api/respond never has to COUNT(*) a chat's messages. A prompt whose reply
+-- failed or was cancelled is stored but not counted.
+ALTER TABLE chats
+  ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE chats c
+SET message_count = 2 * counted.replies
+FROM (SELECT chat_id, COUNT(*) AS replies FROM messages WHERE role = 'assistant' GROUP BY chat_id) counted
+WHERE counted.chat_id = c.id;
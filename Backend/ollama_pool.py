@@ -0,0 +1,183 @@
+# ollama_pool.py
+import os
+import time
+import hashlib
+import asyncio
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+
+from http_client import get_http_session
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+DEFAULT_OLLAMA_HOSTS = "http://localhost:11434,http://localhost:11436,http://localhost:11437,http://localhost:11438"
+OLLAMA_HOSTS = [h.strip().rstrip("/") for h in os.getenv("OLLAMA_HOSTS", DEFAULT_OLLAMA_HOSTS).split(",") if h.strip()]
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "2"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+OLLAMA_MAX_ATTEMPTS = int(os.getenv("OLLAMA_MAX_ATTEMPTS", "3"))
+OLLAMA_LATENCY_ALPHA = float(os.getenv("OLLAMA_LATENCY_ALPHA", "0.3"))
+# How much busier (in-flight requests) a chat's home node may be than the least
+# loaded one before the request is sent elsewhere
+OLLAMA_AFFINITY_SLACK = int(os.getenv("OLLAMA_AFFINITY_SLACK", "2"))
+# Generations one node is given at a time (match the node's OLLAMA_NUM_PARALLEL)
+OLLAMA_NODE_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_NODE_MAX_IN_FLIGHT", "4"))
+# Sent with every generate request; empty leaves Ollama's default (5m)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+def normalize_model(name: str) -> str:
+    return name if ":" in name else f"{name}:latest"
+
+class OllamaNode:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.in_flight = 0
+        self.latency = 0.0  # EWMA of request duration in seconds
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.loaded_models = set()
+
+    @property
+    def generate_url(self) -> str:
+        return f"{self.base_url}/api/generate"
+
+    def is_healthy(self, now: Optional[float] = None) -> bool:
+        return (now or time.monotonic()) >= self.ejected_until
+
+    def snapshot(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.is_healthy(),
+            "in_flight": self.in_flight,
+            "latency": round(self.latency, 3),
+            "failures": self.failures,
+            "loaded_models": sorted(self.loaded_models),
+        }
+
+def _affinity_score(affinity_key: str, model: str, node: OllamaNode) -> bytes:
+    # Rendezvous hashing: stable across processes, and only the chats homed on
+    # an ejected node move when it goes away
+    return hashlib.blake2b(f"{affinity_key}|{model}|{node.base_url}".encode(), digest_size=8).digest()
+
+class OllamaPool:
+    """Least-outstanding-requests routing over a set of Ollama nodes.
+
+    Nodes that already have the model loaded are preferred; nodes that fail
+    requests or health checks are ejected for a cool-down period. Requests
+    with an affinity key (a chat) stick to one node while it is healthy and
+    not much busier than the rest, so its prompt prefix stays in that node's
+    KV cache.
+    """
+
+    def __init__(self, hosts: Iterable[str], max_attempts: int = OLLAMA_MAX_ATTEMPTS):
+        self.nodes: List[OllamaNode] = [OllamaNode(h) for h in hosts]
+        self.max_attempts = max(1, min(max_attempts, len(self.nodes)))
+        self._lock = threading.Lock()
+        self._health_task: Optional[asyncio.Task] = None
+
+    # ---- Routing ----
+    def acquire(self, model: str, exclude: Iterable[OllamaNode] = (), affinity_key: Optional[str] = None) -> Optional[OllamaNode]:
+        model = normalize_model(model)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [n for n in self.nodes if n not in exclude]
+            if not candidates:
+                return None
+            healthy = [n for n in candidates if n.is_healthy(now)]
+            # Fail open: if every node is ejected, still try the least bad one
+            pool = healthy or candidates
+            # Nodes at their cap only get work when every node is
+            pool = [n for n in pool if n.in_flight < OLLAMA_NODE_MAX_IN_FLIGHT] or pool
+            node = min(pool, key=lambda n: (model not in n.loaded_models, n.in_flight, n.latency))
+            if affinity_key is not None:
+                home = max(pool, key=lambda n: _affinity_score(affinity_key, model, n))
+                if home.in_flight - node.in_flight <= OLLAMA_AFFINITY_SLACK:
+                    node = home
+            node.in_flight += 1
+            return node
+
+    def capacity(self, per_node: int) -> int:
+        # Ejected nodes don't count, unless all are (requests then fail open to them)
+        now = time.monotonic()
+        with self._lock:
+            healthy = sum(1 for n in self.nodes if n.is_healthy(now))
+            return per_node * (healthy or len(self.nodes))
+
+    def healthy_nodes(self) -> List[OllamaNode]:
+        now = time.monotonic()
+        with self._lock:
+            healthy = [n for n in self.nodes if n.is_healthy(now)]
+            return sorted(healthy or self.nodes, key=lambda n: (n.in_flight, n.latency))
+
+    def release(self, node: OllamaNode, elapsed: float, model: Optional[str] = None, failed: bool = False):
+        with self._lock:
+            node.in_flight = max(node.in_flight - 1, 0)
+            if failed:
+                self._mark_failure(node)
+                return
+            node.failures = 0
+            node.ejected_until = 0.0
+            node.latency = elapsed if node.latency == 0 else (
+                OLLAMA_LATENCY_ALPHA * elapsed + (1 - OLLAMA_LATENCY_ALPHA) * node.latency
+            )
+            if model:
+                node.loaded_models.add(normalize_model(model))
+
+    def _mark_failure(self, node: OllamaNode):
+        node.failures += 1
+        if node.failures >= OLLAMA_FAILURE_THRESHOLD:
+            node.ejected_until = time.monotonic() + OLLAMA_EJECT_SECONDS
+            logger.warning(f"Ejecting Ollama node {node.base_url} for {OLLAMA_EJECT_SECONDS:.0f}s after {node.failures} failures")
+
+    # ---- Health checks ----
+    async def check_node(self, node: OllamaNode):
+        try:
+            async with get_http_session().get(
+                f"{node.base_url}/api/ps", timeout=aiohttp.ClientTimeout(total=OLLAMA_HEALTH_TIMEOUT)
+            ) as resp:
+                resp.raise_for_status()
+                data = await resp.json()
+            loaded = {normalize_model(m.get("model") or m.get("name", "")) for m in data.get("models", [])}
+            with self._lock:
+                node.loaded_models = loaded
+                if not node.is_healthy():
+                    logger.info(f"Ollama node {node.base_url} passed health check; restoring")
+                node.failures = 0
+                node.ejected_until = 0.0
+        except Exception as e:
+            logger.warning(f"Health check failed for Ollama node {node.base_url}: {e}")
+            with self._lock:
+                node.failures = max(node.failures, OLLAMA_FAILURE_THRESHOLD - 1)
+                self._mark_failure(node)
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check_node(n) for n in self.nodes))
+
+    async def _health_loop(self, interval: float):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(interval)
+
+    def start_health_checks(self, interval: float = OLLAMA_HEALTH_INTERVAL):
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(interval))
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [n.snapshot() for n in self.nodes]
+
+ollama_pool = OllamaPool(OLLAMA_HOSTS)
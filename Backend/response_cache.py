@@ -0,0 +1,134 @@
+# response_cache.py
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ollama_pool import normalize_model
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+# Cosine similarity a prompt needs to reuse another prompt's answer; 0 means exact matches only
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+RESPONSE_CACHE_BYPASS_HEADER = "X-Response-Cache-Bypass"
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+def normalize_prompt(prompt: str) -> str:
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", prompt.strip().lower()))
+
+class CacheEntry:
+    def __init__(self, response: str, embedding: Optional[np.ndarray]):
+        self.response = response
+        self.embedding = embedding
+        self.created = time.monotonic()
+
+class ResponseCache:
+    """LRU + TTL cache of model answers to context-free prompts.
+
+    Entries are keyed on (model, normalized prompt). When a similarity
+    threshold is set and the caller has the prompt's embedding, a miss falls
+    back to the closest cached prompt for the same model above the threshold.
+    Callers must only use it for turns with no chat-specific context.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl: float = RESPONSE_CACHE_TTL,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    @property
+    def uses_embeddings(self) -> bool:
+        return self.similarity > 0
+
+    @staticmethod
+    def _unit(embedding: Optional[List[float]]) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created > self.ttl
+
+    def _closest(self, model: str, query: np.ndarray, now: float) -> Optional[CacheEntry]:
+        keys, vectors = [], []
+        for key, entry in self._entries.items():
+            if key[0] == model and entry.embedding is not None and not self._expired(entry, now):
+                keys.append(key)
+                vectors.append(entry.embedding)
+        if not vectors:
+            return None
+        scores = np.stack(vectors) @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        self._entries.move_to_end(keys[best])
+        return self._entries[keys[best]]
+
+    def get(self, model: str, prompt: str, embedding: Optional[List[float]] = None) -> Optional[str]:
+        key = (normalize_model(model), normalize_prompt(prompt))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.response
+            query = self._unit(embedding) if self.uses_embeddings else None
+            if query is not None:
+                entry = self._closest(key[0], query, now)
+                if entry is not None:
+                    self.semantic_hits += 1
+                    return entry.response
+            self.misses += 1
+            return None
+
+    def put(self, model: str, prompt: str, response: str, embedding: Optional[List[float]] = None):
+        if not response.strip():
+            return
+        key = (normalize_model(model), normalize_prompt(prompt))
+        with self._lock:
+            self._entries[key] = CacheEntry(response, self._unit(embedding) if self.uses_embeddings else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
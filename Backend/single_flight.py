@@ -0,0 +1,124 @@
+# single_flight.py
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _SharedStream:
+    def __init__(self):
+        self.items: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+
+class SingleFlight:
+    """Coalesces identical concurrent upstream calls.
+
+    do(key, fn) runs fn() once per key while it is in flight and hands the
+    result (or exception) to every caller. stream(key, factory) does the same
+    for async iterators: each subscriber sees every item from the start.
+    The upstream work is cancelled only once all of its callers are gone.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.started = 0
+        self.coalesced = 0
+
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Tasks are loop-bound; anything in flight on an old loop is gone with it
+            self._loop, self._calls, self._streams = loop, {}, {}
+        return loop
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        loop = self._bind_loop()
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(loop.create_task(fn()))
+            call.task.add_done_callback(lambda _, key=key, call=call: self._forget(self._calls, key, call))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        loop = self._bind_loop()
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = self._streams[key] = _SharedStream()
+            shared.task = loop.create_task(self._produce(key, shared, factory))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        shared.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with shared.changed:
+                    await shared.changed.wait_for(lambda: position < len(shared.items) or shared.done)
+                    if position < len(shared.items):
+                        item = shared.items[position]
+                        position += 1
+                    elif shared.error is not None:
+                        raise shared.error
+                    else:
+                        return
+                yield item
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                shared.task.cancel()
+
+    async def _produce(self, key: Hashable, shared: _SharedStream, factory: Callable[[], AsyncIterator[T]]):
+        iterator = factory()
+        try:
+            async for item in iterator:
+                async with shared.changed:
+                    shared.items.append(item)
+                    shared.changed.notify_all()
+        except asyncio.CancelledError:
+            shared.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            shared.error = e
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+            self._forget(self._streams, key, shared)
+            async with shared.changed:
+                shared.done = True
+                shared.changed.notify_all()
+
+    @staticmethod
+    def _forget(registry: Dict, key: Hashable, value):
+        # A new flight may already have taken the key
+        if registry.get(key) is value:
+            del registry[key]
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
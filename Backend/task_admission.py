@@ -0,0 +1,60 @@
+# task_admission.py
+import os
+import json
+import time
+import logging
+
+from task_events import get_redis
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+# Background work is held back while the p95 of recent interactive replies is above this
+INTERACTIVE_LATENCY_THRESHOLD = float(os.getenv("INTERACTIVE_LATENCY_THRESHOLD", "10"))
+INTERACTIVE_LATENCY_WINDOW = float(os.getenv("INTERACTIVE_LATENCY_WINDOW", "60"))
+INTERACTIVE_LATENCY_SAMPLES = 100
+BACKGROUND_DEFER_SECONDS = float(os.getenv("BACKGROUND_DEFER_SECONDS", "30"))
+BACKGROUND_MAX_DEFERRALS = int(os.getenv("BACKGROUND_MAX_DEFERRALS", "5"))
+
+_LATENCY_KEY = "interactive_latency"
+
+async def record_interactive_latency(seconds: float):
+    # Shared through Redis so the API and every worker see the same window
+    try:
+        client = get_redis()
+        await client.lpush(_LATENCY_KEY, json.dumps([time.time(), seconds]))
+        await client.ltrim(_LATENCY_KEY, 0, INTERACTIVE_LATENCY_SAMPLES - 1)
+    except Exception as e:
+        logger.warning(f"Could not record interactive latency: {e}")
+
+async def interactive_latency_p95() -> float:
+    samples = await get_redis().lrange(_LATENCY_KEY, 0, -1)
+    cutoff = time.time() - INTERACTIVE_LATENCY_WINDOW
+    recent = sorted(latency for ts, latency in map(json.loads, samples) if ts >= cutoff)
+    if not recent:
+        return 0.0
+    return recent[min(int(len(recent) * 0.95), len(recent) - 1)]
+
+RUN, DEFER, DROP = "run", "defer", "drop"
+
+async def background_admission(task_name: str, retries: int, droppable: bool = False) -> str:
+    """Decide whether a background task may run now.
+
+    Under interactive pressure the task should be deferred (retried later) up
+    to BACKGROUND_MAX_DEFERRALS times. After that it runs anyway, unless it
+    is droppable, in which case it is skipped.
+    """
+    try:
+        p95 = await interactive_latency_p95()
+    except Exception as e:
+        logger.warning(f"Admission check unavailable, running {task_name}: {e}")
+        return RUN
+    if p95 <= INTERACTIVE_LATENCY_THRESHOLD:
+        return RUN
+    if retries < BACKGROUND_MAX_DEFERRALS:
+        logger.info(f"Deferring {task_name}: interactive p95 {p95:.2f}s > {INTERACTIVE_LATENCY_THRESHOLD:.2f}s")
+        return DEFER
+    if droppable:
+        logger.info(f"Dropping {task_name} after {retries} deferrals (interactive p95 {p95:.2f}s)")
+        return DROP
+    return RUN
@@ -0,0 +1,133 @@
+# task_events.py
+import os
+import json
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+import redis.asyncio as aioredis
+
+from celery_worker import REDIS_HOST, REDIS_PORT
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+TASK_EVENTS_URL = os.getenv("TASK_EVENTS_URL", f"redis://{REDIS_HOST}:{REDIS_PORT}/2")
+TASK_EVENTS_TIMEOUT = float(os.getenv("TASK_EVENTS_TIMEOUT", "300"))
+TASK_EVENTS_RESULT_TTL = 3600  # same as Celery's result_expires
+KEEPALIVE_SECONDS = 15
+# How long a task whose last subscriber left keeps running, in case the client reconnects
+TASK_CANCEL_GRACE_SECONDS = float(os.getenv("TASK_CANCEL_GRACE_SECONDS", "5"))
+
+def _channel(task_id: str) -> str:
+    return f"task_events:{task_id}"
+
+def _final_key(task_id: str) -> str:
+    return f"task_final:{task_id}"
+
+def _cancel_key(task_id: str) -> str:
+    return f"task_cancel:{task_id}"
+
+def is_final(event: dict) -> bool:
+    return bool(event.get("done") or event.get("error"))
+
+# One client per process, bound to the loop that opened its connections (the API's
+# loop, or a worker's persistent runtime loop). As with the HTTP session, a caller on
+# another loop replaces it, and the old client is closed on its own loop if that loop
+# still runs; otherwise it is dropped.
+_client: Optional[aioredis.Redis] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _retire_client():
+    global _client, _client_loop
+    client, loop = _client, _client_loop
+    _client, _client_loop = None, None
+    if client is None:
+        return
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+    else:
+        logger.warning("Dropping a Redis client whose event loop has ended without closing it")
+
+def get_redis() -> aioredis.Redis:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client_loop is not loop:
+        _retire_client()
+    if _client is None:
+        _client, _client_loop = aioredis.from_url(TASK_EVENTS_URL, decode_responses=True), loop
+    return _client
+
+async def close_redis():
+    global _client, _client_loop
+    if _client_loop is asyncio.get_running_loop():
+        client, _client, _client_loop = _client, None, None
+        await client.aclose()
+    else:
+        _retire_client()
+
+# ---- Worker side ----
+async def publish_event(task_id: str, event: dict):
+    """Push an event to subscribers. The final event is also kept for a while
+    so a client that subscribes after the task finished still gets it."""
+    client = get_redis()
+    payload = json.dumps(event)
+    if is_final(event):
+        await client.set(_final_key(task_id), payload, ex=TASK_EVENTS_RESULT_TTL)
+    await client.publish(_channel(task_id), payload)
+
+async def cancel_requested(task_id: str) -> Optional[str]:
+    return await get_redis().get(_cancel_key(task_id))
+
+# ---- API side ----
+async def request_cancel(task_id: str, reason: str):
+    # Checked by the worker while it streams; queued tasks are revoked by the caller
+    await get_redis().set(_cancel_key(task_id), reason, ex=TASK_EVENTS_RESULT_TTL)
+
+async def cancel_if_abandoned(task_id: str, grace: float = TASK_CANCEL_GRACE_SECONDS) -> bool:
+    """Ask the worker to stop if, after the grace period, nobody is listening
+    for the task's events and it hasn't finished."""
+    await asyncio.sleep(grace)
+    client = get_redis()
+    if await client.exists(_final_key(task_id)):
+        return False
+    subscribers = dict(await client.pubsub_numsub(_channel(task_id))).get(_channel(task_id), 0)
+    if subscribers:
+        return False
+    await request_cancel(task_id, "client_disconnect")
+    return True
+
+async def subscribe_events(task_id: str, timeout: float = TASK_EVENTS_TIMEOUT) -> AsyncIterator[dict]:
+    """Yield a task's events until its final one (done or error)."""
+    client = get_redis()
+    pubsub = client.pubsub()
+    await pubsub.subscribe(_channel(task_id))
+    try:
+        # Subscribed first, so a result stored now can't slip between the check and the listen
+        stored = await client.get(_final_key(task_id))
+        if stored:
+            yield json.loads(stored)
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        last_sent = loop.time()
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                yield {"error": "Timed out waiting for the response"}
+                return
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=min(remaining, KEEPALIVE_SECONDS))
+            if message is None:
+                # Also returned for skipped subscribe confirmations, so only ping when actually idle
+                if loop.time() - last_sent >= KEEPALIVE_SECONDS:
+                    last_sent = loop.time()
+                    yield {"keepalive": True}
+                continue
+            last_sent = loop.time()
+            event = json.loads(message["data"])
+            yield event
+            if is_final(event):
+                return
+    finally:
+        await pubsub.unsubscribe(_channel(task_id))
+        await pubsub.aclose()
@@ -1,34 +1,120 @@
 from celery_worker import celery_app
-from utils import get_llm, remove_think_tags, database
-import asyncio
+from worker_runtime import worker_runtime  # also registers the worker process hooks
+from metrics import timed, STAGE_SECONDS, RESPONSE_SECONDS, TIME_TO_FIRST_TOKEN
+from cancellation import Deadline, GenerationCancelled, stream_guarded
+import os
+import time
 
-@celery_app.task
-def generate_response_task(model: str, full_context: str) -> str:
-    llm = get_llm(model)
-    chain = llm | (lambda ctx: ctx["context"])
-    raw = chain.invoke({"context": full_context})
-    return remove_think_tags(raw)
+# Streamed tokens are coalesced so a fast model doesn't cost one Redis publish per token
+TASK_EVENTS_FLUSH_MS = float(os.getenv("TASK_EVENTS_FLUSH_MS", "50"))
+# How often a running generation checks whether it was cancelled
+TASK_CANCEL_POLL_SECONDS = float(os.getenv("TASK_CANCEL_POLL_SECONDS", "1"))
 
+@celery_app.task(bind=True)
+def generate_response_task(self, model: str, full_context: str, num_ctx: int = None,
+                           chat_id: int = None, prompt: str = None,
+                           enqueued_at: float = None, deadline_at: float = None) -> str:
+    """Generate a reply, pushing partial output and completion to subscribers
+    of the task's event channel. With chat_id set, the worker also stores the
+    reply (the API already stored the prompt) and schedules title/summary
+    work. The generation stops at deadline_at or when the API asks for it to
+    be cancelled."""
+    from utils import get_llm, remove_think_tags, ThinkTagFilter, chat_affinity_key
+    from task_events import publish_event, cancel_requested
+    from task_admission import record_interactive_latency
+    import chat_repository
+    task_id = self.request.id  # request is thread-local; the body runs on the runtime's loop thread
 
-@celery_app.task
-def generate_title_task(chat_id: int, first_msg: str, model: str):
-    from utils import generate_title
     async def run():
-        await database.connect()
+        llm = get_llm(model, num_ctx=num_ctx)
+        think_filter = ThinkTagFilter()
+        parts, pending, last_flush = [], [], time.monotonic()
+        generation_start = time.perf_counter()
+        deadline = Deadline.at(deadline_at) if deadline_at else Deadline()
+        tokens = llm.astream_tokens(full_context, affinity_key=chat_affinity_key(chat_id) if chat_id is not None else None)
         try:
-            await generate_title(database, chat_id, first_msg, model)
-        finally:
-            await database.disconnect()
-    asyncio.run(run())
+            async for token in stream_guarded(tokens, deadline, lambda: cancel_requested(task_id), poll=TASK_CANCEL_POLL_SECONDS):
+                text = think_filter.feed(token)
+                if text:
+                    if not parts and enqueued_at is not None:
+                        TIME_TO_FIRST_TOKEN.labels(model).observe(time.time() - enqueued_at)
+                    parts.append(text)
+                    pending.append(text)
+                if pending and (time.monotonic() - last_flush) * 1000 >= TASK_EVENTS_FLUSH_MS:
+                    await publish_event(task_id, {"token": "".join(pending)})
+                    pending, last_flush = [], time.monotonic()
+            tail = think_filter.flush()
+            if tail:
+                parts.append(tail)
+                pending.append(tail)
+            if pending:
+                await publish_event(task_id, {"token": "".join(pending)})
+        except GenerationCancelled as e:
+            # Nothing is stored: the reply was abandoned or ran out of time
+            message = "The response took too long. Please try again." if e.reason == "deadline" else "Cancelled"
+            await publish_event(task_id, {"error": message, "cancelled": True})
+            return None
+        except Exception as e:
+            await publish_event(task_id, {"error": str(getattr(e, "detail", e))})
+            raise
+        STAGE_SECONDS.labels("generation").observe(time.perf_counter() - generation_start)
 
+        response = remove_think_tags("".join(parts))
+        if chat_id is not None:
+            with timed("persist"):
+                stored_count = await chat_repository.save_reply(chat_id, response)
+            schedule_followups(chat_id, model, prompt, stored_count)
+        await publish_event(task_id, {"done": True, "chat_id": chat_id, "response": response})
+        if enqueued_at is not None:
+            # Includes queue wait: that's what background admission is protecting
+            elapsed = time.time() - enqueued_at
+            RESPONSE_SECONDS.labels("ollama").observe(elapsed)
+            await record_interactive_latency(elapsed)
+        return response
+    return worker_runtime.run(run())
 
-@celery_app.task
-def summarize_chat_task(chat_id: int, model: str, messages: list):
-    from utils import summarize_chat
-    async def run():
-        await database.connect()
-        try:
-            await summarize_chat(database, chat_id, model, messages)
-        finally:
-            await database.disconnect()
-    asyncio.run(run())
+
+def _admit_background(task, droppable: bool = False) -> bool:
+    from task_admission import background_admission, DEFER, DROP, BACKGROUND_DEFER_SECONDS, BACKGROUND_MAX_DEFERRALS
+    decision = worker_runtime.run(background_admission(task.name, task.request.retries, droppable))
+    if decision == DEFER:
+        raise task.retry(countdown=BACKGROUND_DEFER_SECONDS, max_retries=BACKGROUND_MAX_DEFERRALS)
+    return decision != DROP
+
+
+@celery_app.task(bind=True)
+def generate_title_task(self, chat_id: int, first_msg: str, model: str):
+    from utils import generate_title, database
+    if _admit_background(self):
+        worker_runtime.run(generate_title(database, chat_id, first_msg, model))
+
+
+@celery_app.task(bind=True)
+def summarize_chat_task(self, chat_id: int, model: str, messages: list = None):
+    # Messages are read from the database by id range; the argument is only
+    # accepted so tasks queued by older app versions still run.
+    from utils import summarize_chat, database
+    # A skipped cycle is caught up by the next one, so summaries may be dropped
+    if _admit_background(self, droppable=True):
+        worker_runtime.run(summarize_chat(database, chat_id, model))
+
+
+async def cancel_response_task(task_id: str, reason: str):
+    from task_events import request_cancel
+    # The flag stops a running generation; revoking drops it if it is still queued
+    await request_cancel(task_id, reason)
+    celery_app.control.revoke(task_id)
+
+
+async def cancel_abandoned_task(task_id: str):
+    from task_events import cancel_if_abandoned
+    if await cancel_if_abandoned(task_id):
+        celery_app.control.revoke(task_id)
+
+
+def schedule_followups(chat_id: int, model: str, prompt: str, msg_count: int):
+    # msg_count includes the exchange just stored
+    if msg_count == 2:
+        generate_title_task.delay(chat_id, prompt, model)
+    if msg_count is not None and msg_count >= 6 and msg_count % 6 == 0:
+        summarize_chat_task.delay(chat_id, model)
@@ -0,0 +1,125 @@
+import time
+import asyncio
+
+import pytest
+
+from cancellation import Deadline, GenerationCancelled, disconnect_probe, run_guarded, stream_guarded
+
+class Generation:
+    """A fake upstream call that records whether it was cancelled or closed."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.cancelled = False
+        self.closed = False
+
+    async def call(self):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return "reply"
+
+    async def tokens(self, count: int = 3):
+        try:
+            for i in range(count):
+                await asyncio.sleep(self.delay)
+                yield i
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        finally:
+            self.closed = True
+
+def probe_after(calls: int, reason: str = "client_disconnect"):
+    seen = {"calls": 0}
+    async def probe():
+        seen["calls"] += 1
+        return reason if seen["calls"] >= calls else None
+    return probe
+
+def test_deadline_counts_down_from_its_start():
+    deadline = Deadline(10, start=time.time() - 4)
+    assert 5 < deadline.remaining() <= 6 and not deadline.expired
+    assert Deadline(1, start=time.time() - 2).expired
+    assert Deadline(1, start=time.time() - 2).remaining() == 0
+
+    # A worker rebuilds the same deadline from the epoch timestamp it was handed
+    assert Deadline.at(deadline.expires_at).expires_at == deadline.expires_at
+
+def test_run_guarded_returns_the_result():
+    generation = Generation(delay=0.02)
+    assert asyncio.run(run_guarded(generation.call(), Deadline(5), probe_after(1000), poll=0.01)) == "reply"
+    assert not generation.cancelled
+
+def test_run_guarded_cancels_at_the_deadline():
+    generation = Generation(delay=5)
+    start = time.monotonic()
+    with pytest.raises(GenerationCancelled) as e:
+        asyncio.run(run_guarded(generation.call(), Deadline(0.05), poll=1))
+    assert e.value.reason == "deadline"
+    assert generation.cancelled
+    assert time.monotonic() - start < 1  # not held up by the poll interval
+
+def test_run_guarded_cancels_when_the_probe_says_so():
+    generation = Generation(delay=5)
+    with pytest.raises(GenerationCancelled) as e:
+        asyncio.run(run_guarded(generation.call(), Deadline(5), probe_after(2), poll=0.01))
+    assert e.value.reason == "client_disconnect"
+    assert generation.cancelled
+
+def test_cancelled_caller_cancels_the_generation():
+    generation = Generation(delay=5)
+    async def main():
+        task = asyncio.ensure_future(run_guarded(generation.call(), Deadline(5), poll=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return task
+    assert asyncio.run(main()).cancelled()
+    assert generation.cancelled
+
+def test_stream_guarded_relays_every_token():
+    generation = Generation(delay=0.01)
+    async def main():
+        return [t async for t in stream_guarded(generation.tokens(), Deadline(5), probe_after(1000), poll=0.005)]
+    assert asyncio.run(main()) == [0, 1, 2]
+    assert generation.closed and not generation.cancelled
+
+@pytest.mark.parametrize("deadline, probe_calls, reason", [
+    (0.15, None, "deadline"),
+    (5, 5, "client_disconnect"),
+])
+def test_stream_guarded_stops_mid_stream(deadline, probe_calls, reason):
+    generation = Generation(delay=0.1)
+    probe = probe_after(probe_calls) if probe_calls else None
+    received = []
+    async def main():
+        async for token in stream_guarded(generation.tokens(count=100), Deadline(deadline), probe, poll=0.02):
+            received.append(token)
+    with pytest.raises(GenerationCancelled) as e:
+        asyncio.run(main())
+    assert e.value.reason == reason
+    assert 0 < len(received) < 100
+    assert generation.cancelled and generation.closed
+
+def test_stream_guarded_checks_before_the_first_token():
+    generation = Generation(delay=5)
+    async def main():
+        async for _ in stream_guarded(generation.tokens(), Deadline(5), probe_after(1), poll=0.01):
+            pass
+    with pytest.raises(GenerationCancelled):
+        asyncio.run(main())
+    assert generation.cancelled
+
+def test_disconnect_probe_reads_the_request():
+    class FakeRequest:
+        def __init__(self, disconnected):
+            self.disconnected = disconnected
+
+        async def is_disconnected(self):
+            return self.disconnected
+
+    assert asyncio.run(disconnect_probe(FakeRequest(False))()) is None
+    assert asyncio.run(disconnect_probe(FakeRequest(True))()) == "client_disconnect"
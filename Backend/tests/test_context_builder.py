@@ -0,0 +1,71 @@
+import pytest
+
+import tokenizer
+from tokenizer import get_encoding
+from context_builder import pack_context
+
+@pytest.fixture(scope="module")
+def encoding():
+    try:
+        return get_encoding()
+    except Exception as e:  # the BPE file is downloaded on first use
+        pytest.skip(f"tokenizer encoding unavailable: {e}")
+
+def tokens(encoding, text):
+    return len(encoding.encode(text, disallowed_special=()))
+
+def words(prefix, n):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+def history(n, size=40):
+    return [{"id": i, "role": "user" if i % 2 else "assistant", "content": words(f"m{i}-", size)} for i in range(n)]
+
+@pytest.mark.parametrize("context_limit", [600, 1024, 2048, 8192])
+def test_rendered_prompt_fits_the_budget(encoding, context_limit):
+    packed = pack_context(
+        prompt=words("q", 50),
+        summary=words("s", 400),
+        retrieved=[words(f"r{i}-", 120) for i in range(6)],
+        recent=history(40),
+        file_section=words("f", 2000),
+        context_limit=context_limit,
+        reserved_output=256,
+    )
+    rendered = packed.render()
+    assert tokens(encoding, rendered) <= context_limit - 256
+    assert packed.used_tokens <= context_limit - 256
+
+def test_everything_kept_when_it_fits(encoding):
+    recent = history(4, size=5)
+    packed = pack_context("hello", "short summary", ["fact one", "fact two"], recent, "", context_limit=4096, reserved_output=256)
+    assert packed.sections["summary"] == "short summary"
+    assert packed.sections["retrieved"] == "fact one\nfact two"
+    assert packed.sections["recent"].count("\n") == len(recent) - 1
+
+def test_recent_history_keeps_newest_contiguous_messages(encoding):
+    recent = history(30)
+    packed = pack_context("hi", "", [], recent, "", context_limit=900, reserved_output=256)
+    kept = packed.sections["recent"].splitlines()
+    assert 0 < len(kept) < len(recent)
+    # A suffix of the conversation, in chronological order
+    expected = [f"{m['role'].capitalize()}: {m['content']}" for m in recent[-len(kept):]]
+    assert kept == expected
+
+def test_oversized_prompt_is_truncated(encoding):
+    packed = pack_context(words("q", 5000), "", [], [], "", context_limit=1024, reserved_output=256)
+    assert tokens(encoding, packed.render()) <= 1024 - 256
+
+class WhitespaceEncoding:
+    name = "test-whitespace"
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+def test_counts_with_the_requested_models_encoding(monkeypatch):
+    monkeypatch.setitem(tokenizer._encoders, "whitespace-model", WhitespaceEncoding())
+    packed = pack_context(words("q", 10), "", [], [], "", context_limit=1000, reserved_output=0, model="whitespace-model")
+    template = WhitespaceEncoding().encode(packed.render().replace(words("q", 10), ""))
+    assert packed.used_tokens == len(template) + 10
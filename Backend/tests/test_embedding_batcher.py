@@ -0,0 +1,57 @@
+import asyncio
+
+from embedding_batcher import EmbeddingBatcher
+
+class Upstream:
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.batches = []
+
+    async def __call__(self, texts):
+        self.batches.append(list(texts))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return [[float(len(t))] for t in texts]
+
+def test_concurrent_requests_share_one_batch():
+    async def main():
+        upstream = Upstream()
+        batcher = EmbeddingBatcher(upstream, max_batch_size=8, window_ms=20)
+        vectors = await asyncio.gather(*(batcher.embed(t) for t in ["a", "bb", "ccc"]))
+        assert vectors == [[1.0], [2.0], [3.0]]
+        assert upstream.batches == [["a", "bb", "ccc"]]
+    asyncio.run(main())
+
+def test_identical_texts_are_sent_once():
+    async def main():
+        upstream = Upstream(delay=0.05)
+        batcher = EmbeddingBatcher(upstream, max_batch_size=8, window_ms=5)
+        first = asyncio.gather(*(batcher.embed("same") for _ in range(3)), batcher.embed("other"))
+        await asyncio.sleep(0.02)  # the batch is now in flight
+        late = batcher.embed("same")  # joins it instead of starting another
+        results = await asyncio.gather(first, late)
+        assert results == [[[4.0], [4.0], [4.0], [5.0]], [4.0]]
+        assert upstream.batches == [["same", "other"]]
+        assert batcher.coalesced == 1
+    asyncio.run(main())
+
+def test_batches_never_exceed_max_size():
+    async def main():
+        upstream = Upstream()
+        batcher = EmbeddingBatcher(upstream, max_batch_size=4, window_ms=50)
+        texts = [f"text {i}" for i in range(10)]
+        vectors = await batcher.embed_many(texts)
+        assert vectors == [[float(len(t))] for t in texts]
+        assert [len(b) for b in upstream.batches] == [4, 4, 2]
+    asyncio.run(main())
+
+def test_failure_reaches_every_waiter():
+    async def main():
+        batcher = EmbeddingBatcher(Upstream(fail=True), max_batch_size=8, window_ms=5)
+        results = await asyncio.gather(batcher.embed("a"), batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        # Nothing is left registered as in flight
+        assert batcher._in_flight == {} and batcher._pending == {}
+    asyncio.run(main())
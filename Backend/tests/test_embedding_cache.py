@@ -0,0 +1,35 @@
+import asyncio
+
+from embedding_cache import EmbeddingCache, DiskEmbeddingStore
+
+VECTOR = [0.0, 0.5, 0.75]  # exact in float32
+
+def test_vectors_survive_a_restart(tmp_path):
+    EmbeddingCache(str(tmp_path)).put("model", "hello", VECTOR)
+    cache = EmbeddingCache(str(tmp_path))
+    assert cache.get("model", "hello") == VECTOR
+    assert cache.get("model", "other") is None
+    assert cache.get("model", "hello") == VECTOR
+    assert (cache.disk_hits, cache.misses, cache.hits) == (1, 1, 1)
+
+def test_async_lookups_reach_the_disk_store(tmp_path):
+    async def main():
+        writer = EmbeddingCache(str(tmp_path))
+        await writer.aput("model", "hello", VECTOR)
+        assert await writer.aget("model", "hello") == VECTOR  # from memory
+        await asyncio.sleep(0.1)  # the append runs in the background
+        return await EmbeddingCache(str(tmp_path)).aget("model", "hello")
+    assert asyncio.run(main()) == VECTOR
+
+def test_disk_io_runs_outside_the_cache_lock(tmp_path, monkeypatch):
+    cache = EmbeddingCache(str(tmp_path))
+    held = []
+    for name in ("get", "put"):
+        original = getattr(DiskEmbeddingStore, name)
+        def spy(self, *args, _original=original):
+            held.append(cache._lock.locked())
+            return _original(self, *args)
+        monkeypatch.setattr(DiskEmbeddingStore, name, spy)
+    cache.put("model", "hello", VECTOR)
+    cache.get("model", "missing")
+    assert held == [False, False]
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import generation_admission
+from generation_admission import GenerationAdmission
+from ollama_pool import OllamaPool
+
+@pytest.fixture(autouse=True)
+def roomy_pool(monkeypatch):
+    # Node capacity never binds; each test sets max_in_flight instead
+    monkeypatch.setattr(generation_admission, "ollama_pool", OllamaPool(["http://node"] * 8))
+
+def admission(**limits):
+    limits = {"max_in_flight": 1, "max_per_user": 1, "max_queue": 8, "max_queued_per_user": 4, "queue_timeout": 5, **limits}
+    return GenerationAdmission(**limits)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def assert_retry_after(error):
+    assert int(error.headers["Retry-After"]) >= 1
+
+def test_full_queue_is_rejected_with_429():
+    async def test():
+        gate = admission(max_queue=2, max_per_user=4, max_in_flight=1)
+        await gate.acquire("holder")
+        waiters = [asyncio.ensure_future(gate.acquire(f"user{i}")) for i in range(2)]
+        await settle()
+        with pytest.raises(HTTPException) as e:
+            await gate.acquire("late")
+        assert e.value.status_code == 429
+        assert_retry_after(e.value)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert gate.queued == 0
+    asyncio.run(test())
+
+def test_user_over_their_queue_share_is_rejected_with_429():
+    async def test():
+        gate = admission(max_queued_per_user=1)
+        await gate.acquire("heavy")
+        waiter = asyncio.ensure_future(gate.acquire("heavy"))
+        await settle()
+        with pytest.raises(HTTPException) as e:
+            await gate.acquire("heavy")
+        assert e.value.status_code == 429 and "Too many requests" in e.value.detail
+        assert_retry_after(e.value)
+
+        # Other users can still queue
+        other = asyncio.ensure_future(gate.acquire("light"))
+        await settle()
+        assert gate.queued == 2
+        for task in (waiter, other):
+            task.cancel()
+        await asyncio.gather(waiter, other, return_exceptions=True)
+    asyncio.run(test())
+
+def test_queue_timeout_is_rejected_with_503():
+    async def test():
+        gate = admission(queue_timeout=0.05)
+        await gate.acquire("holder")
+        with pytest.raises(HTTPException) as e:
+            await gate.acquire("waiter")
+        assert e.value.status_code == 503
+        assert_retry_after(e.value)
+        assert gate.queued == 0
+
+        # The caller's own deadline can be shorter than the queue timeout
+        gate.queue_timeout = 60
+        with pytest.raises(HTTPException):
+            await asyncio.wait_for(gate.acquire("waiter", timeout=0.05), 1)
+    asyncio.run(test())
+
+def test_waiters_are_served_round_robin_across_users():
+    async def test():
+        gate = admission()
+        holder = await gate.acquire("heavy")
+        granted = []
+
+        async def request(user):
+            slot = await gate.acquire(user)
+            granted.append(user)
+            await asyncio.sleep(0)
+            slot.release()
+
+        # The heavy user queues first, but the light user is not stuck behind all of it
+        tasks = [asyncio.ensure_future(request("heavy")) for _ in range(3)]
+        await settle()
+        tasks.append(asyncio.ensure_future(request("light")))
+        await settle()
+        holder.release()
+        await asyncio.gather(*tasks)
+        assert granted == ["heavy", "light", "heavy", "heavy"]
+        assert gate.stats()["in_flight"] == 0
+    asyncio.run(test())
+
+def test_per_user_cap_leaves_room_for_others():
+    async def test():
+        gate = admission(max_in_flight=2, max_per_user=1)
+        async with gate.slot("heavy"):
+            second = asyncio.ensure_future(gate.acquire("heavy"))
+            await settle()
+            assert not second.done()
+            async with gate.slot("light"):
+                assert gate.in_flight == 2
+        slot = await second
+        assert slot.user == "heavy"
+        slot.release()
+        slot.release()  # idempotent
+        assert gate.in_flight == 0
+    asyncio.run(test())
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def test():
+        gate = admission()
+        holder = await gate.acquire("holder")
+        leaving = asyncio.ensure_future(gate.acquire("leaving"))
+        staying = asyncio.ensure_future(gate.acquire("staying"))
+        await settle()
+        leaving.cancel()
+        await asyncio.gather(leaving, return_exceptions=True)
+        assert gate.queued == 1
+
+        holder.release()
+        assert (await staying).user == "staying"
+    asyncio.run(test())
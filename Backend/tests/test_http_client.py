@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+import http_client
+from http_client import get_http_session, start_http_client, close_http_client
+
+def test_one_session_per_loop_until_closed():
+    async def main():
+        await start_http_client()
+        session = get_http_session()
+        assert get_http_session() is session
+        await close_http_client()
+        assert session.closed and http_client._session is None
+    asyncio.run(main())
+
+def test_session_of_a_running_loop_is_closed_when_replaced():
+    # e.g. the app's loop in one thread and a script's loop in another
+    other = asyncio.new_event_loop()
+    thread = threading.Thread(target=other.run_forever, daemon=True)
+    thread.start()
+    try:
+        async def create():
+            return get_http_session()
+        old = asyncio.run_coroutine_threadsafe(create(), other).result()
+
+        async def main():
+            new = get_http_session()
+            assert new is not old
+            await close_http_client()
+        asyncio.run(main())
+
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), other).result()
+        assert old.closed
+    finally:
+        other.call_soon_threadsafe(other.stop)
+        thread.join()
+        other.close()
+
+def test_session_of_a_finished_loop_is_not_kept():
+    async def leave_open():
+        return get_http_session()
+    old = asyncio.run(leave_open())
+
+    async def main():
+        assert get_http_session() is not old
+        await close_http_client()
+    asyncio.run(main())
+    assert http_client._session is None
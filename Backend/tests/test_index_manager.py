@@ -0,0 +1,88 @@
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import index_manager
+from index_manager import VectorIndexManager
+
+class FakeIndex:
+    """Just enough of a FAISS vector store for the manager's bookkeeping."""
+
+    def __init__(self):
+        self.index = types.SimpleNamespace(ntotal=1, d=4)
+        self.docstore = types.SimpleNamespace(_dict={})
+        self.documents = 0
+
+    def add_documents(self, documents):
+        self.documents += len(documents)
+
+@pytest.fixture
+def saves(monkeypatch):
+    saved = []
+    state = {"fail": False}
+
+    def save(index, chat_id):
+        if state["fail"]:
+            raise OSError("disk full")
+        saved.append((chat_id, index.documents))
+
+    monkeypatch.setattr(index_manager, "get_faiss_index", lambda chat_id: FakeIndex())
+    monkeypatch.setattr(index_manager, "save_faiss_index", save)
+    # One worker, so drain() returns once every queued eviction save has run
+    monkeypatch.setattr(index_manager, "_faiss_executor", ThreadPoolExecutor(max_workers=1))
+    return saved, state
+
+def drain():
+    index_manager._faiss_executor.submit(lambda: None).result()
+
+def test_entry_being_written_is_not_evicted(saves):
+    saved, _ = saves
+    manager = VectorIndexManager(max_indexes=1)
+    with manager._writable(1) as entry:
+        manager.get(2)
+        assert 1 in manager._entries
+        entry.index.add_documents(["doc"])
+        manager._mark_dirty(entry)
+    manager.get(3)
+    drain()
+    assert not entry.dirty and 1 not in manager._evicted
+    assert saved == [(1, 1)]
+
+def test_write_after_eviction_goes_to_registered_entry(saves):
+    saved, _ = saves
+    manager = VectorIndexManager(max_indexes=1)
+    stale = manager._entry(1)
+    manager.get(2)  # evicts chat 1 while it is clean
+    manager.add_documents(1, ["a", "b"])
+    entry = manager._entries[1]
+    assert entry is not stale and entry.dirty
+    manager.flush()
+    assert saved == [(1, 2)]
+
+def test_failed_save_stays_dirty_and_is_retried(saves):
+    saved, state = saves
+    manager = VectorIndexManager()
+    manager.add_documents(1, ["a"])
+    state["fail"] = True
+    manager.flush()
+    assert manager._entries[1].dirty and saved == []
+    state["fail"] = False
+    manager.flush()
+    assert not manager._entries[1].dirty and saved == [(1, 1)]
+
+def test_unsaved_eviction_stays_parked_and_counts_against_memory(saves):
+    saved, state = saves
+    manager = VectorIndexManager(max_bytes=40)  # each fake index is 16 bytes
+    manager.add_documents(1, ["a"])
+    state["fail"] = True
+    manager.get(2)
+    manager.get(3)  # over budget: chat 1 is evicted, but its save fails
+    drain()
+    assert manager._evicted[1].dirty
+    # The parked index still takes memory, so chat 2 had to go as well
+    assert list(manager._entries) == [3]
+
+    state["fail"] = False
+    manager.flush()
+    assert saved == [(1, 1)] and not manager._evicted
@@ -0,0 +1,173 @@
+import json
+import asyncio
+
+import pytest
+from aiohttp import web
+from fastapi import HTTPException
+
+import utils
+from http_client import close_http_client
+from ollama_pool import OllamaPool, OLLAMA_FAILURE_THRESHOLD
+
+class StubNode:
+    """A local HTTP server answering /api/generate and /api/ps like an Ollama node."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.status = 200
+        self.hits = 0
+        self.runner = None
+        self.url = None
+
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        self.hits += 1
+        body = await request.json()
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.json_response({"error": "boom"}, status=self.status)
+        if not body.get("stream", True):
+            return web.json_response({"response": f"from {self.url}", "done": True})
+        response = web.StreamResponse()
+        await response.prepare(request)
+        try:
+            for token in ["a", "b", "c"]:
+                await response.write((json.dumps({"response": token, "done": False}) + "\n").encode())
+                await asyncio.sleep(self.delay)
+            await response.write(b'{"response": "", "done": true}\n')
+        except ConnectionResetError:
+            pass  # the client hung up
+        return response
+
+    async def ps(self, request: web.Request) -> web.Response:
+        if self.status != 200:
+            return web.json_response({"error": "down"}, status=self.status)
+        return web.json_response({"models": []})
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([web.post("/api/generate", self.generate), web.get("/api/ps", self.ps)])
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+def run_with_nodes(monkeypatch, count, test, delay=0.0):
+    async def main():
+        nodes = [StubNode(delay) for _ in range(count)]
+        for node in nodes:
+            await node.start()
+        pool = OllamaPool([n.url for n in nodes])
+        monkeypatch.setattr(utils, "ollama_pool", pool)
+        try:
+            await test(pool, {n.url: n for n in nodes})
+        finally:
+            await close_http_client()
+            for node in nodes:
+                await node.stop()
+    asyncio.run(main())
+
+def llm():
+    return utils.OllamaLLM(model="stub")
+
+def in_flight(pool):
+    return [n.in_flight for n in pool.nodes]
+
+async def wait_idle(pool, timeout=1.0):
+    # Abandoned upstream calls are cancelled in the background
+    deadline = asyncio.get_running_loop().time() + timeout
+    while any(in_flight(pool)) and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.01)
+    return in_flight(pool)
+
+def prefer(first, other):
+    # Routing picks loaded model, then fewest in flight, then lowest latency
+    first.loaded_models.add("stub:latest")
+    first.latency, other.latency = 0.0, 1.0
+
+def test_least_outstanding_routing(monkeypatch):
+    async def test(pool, stubs):
+        results = await asyncio.gather(*(llm().ainvoke(f"prompt {i}") for i in range(4)))
+        assert len(results) == 4
+        assert sorted(s.hits for s in stubs.values()) == [2, 2]
+        assert in_flight(pool) == [0, 0]
+    run_with_nodes(monkeypatch, 2, test, delay=0.2)
+
+def test_acquire_prefers_idle_node():
+    pool = OllamaPool(["http://a", "http://b", "http://c"])
+    first, second, third = (pool.acquire("stub") for _ in range(3))
+    assert len({first, second, third}) == 3
+    pool.release(second, 0.1)
+    assert pool.acquire("stub") is second
+
+def test_failover_to_next_node(monkeypatch):
+    async def test(pool, stubs):
+        bad, good = pool.nodes
+        stubs[bad.base_url].status = 500
+        prefer(bad, good)
+        assert await llm().ainvoke("hello") == f"from {good.base_url}"
+        assert stubs[bad.base_url].hits == 1
+        assert bad.failures == 1
+        assert in_flight(pool) == [0, 0]
+    run_with_nodes(monkeypatch, 2, test)
+
+def test_all_nodes_failing_raises_503(monkeypatch):
+    async def test(pool, stubs):
+        for stub in stubs.values():
+            stub.status = 500
+        with pytest.raises(HTTPException) as e:
+            await llm().ainvoke("hello")
+        assert e.value.status_code == 503
+        assert in_flight(pool) == [0, 0]
+    run_with_nodes(monkeypatch, 2, test)
+
+def test_node_ejected_after_failures_and_restored(monkeypatch):
+    async def test(pool, stubs):
+        bad, good = pool.nodes
+        stubs[bad.base_url].status = 500
+        for i in range(OLLAMA_FAILURE_THRESHOLD):
+            prefer(bad, good)
+            await llm().ainvoke(f"prompt {i}")
+        assert not bad.is_healthy()
+        hits = stubs[bad.base_url].hits
+
+        # Ejected: traffic skips the node even though it looks cheaper
+        prefer(bad, good)
+        await llm().ainvoke("after ejection")
+        assert stubs[bad.base_url].hits == hits
+
+        # Still down: the health check keeps it out
+        await pool.check_node(bad)
+        assert not bad.is_healthy()
+
+        stubs[bad.base_url].status = 200
+        await pool.check_node(bad)
+        assert bad.is_healthy() and bad.failures == 0
+        prefer(bad, good)
+        await llm().ainvoke("restored")
+        assert stubs[bad.base_url].hits == hits + 1
+    run_with_nodes(monkeypatch, 2, test)
+
+def test_in_flight_returns_to_zero_after_streams(monkeypatch):
+    async def test(pool, stubs):
+        tokens = [t async for t in llm().astream_tokens("full stream")]
+        assert tokens == ["a", "b", "c"]
+        assert in_flight(pool) == [0, 0]
+
+        # Consumer stops early
+        stream = llm().astream_tokens("abandoned stream")
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+        assert await wait_idle(pool) == [0, 0]
+
+        # Consumer cancelled while waiting on the node
+        task = asyncio.ensure_future(llm().ainvoke("cancelled call"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert await wait_idle(pool) == [0, 0]
+        assert all(n.is_healthy() for n in pool.nodes)
+    run_with_nodes(monkeypatch, 2, test, delay=0.1)
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+from databases import Database
+
+from utils import DATABASE_URL
+from chat_repository import history_page_query, LIST_CHATS_QUERY
+from migrations import run_migrations, explain, plan_nodes, plan_uses_index, plan_has_seq_scan
+
+def plan_for(query, values):
+    """Plan of a query on the configured Postgres, with migrations applied."""
+    async def main():
+        database = Database(DATABASE_URL)
+        try:
+            await database.connect()
+        except Exception as e:  # no local Postgres
+            pytest.skip(f"database unavailable: {e}")
+        try:
+            await run_migrations(database)
+            return await explain(database, query, values, force_index=True)
+        finally:
+            await database.disconnect()
+    return asyncio.run(main())
+
+def sorts(plan):
+    return [node for node in plan_nodes(plan) if node["Node Type"] in ("Sort", "Incremental Sort")]
+
+@pytest.mark.parametrize("before", [None, 1])
+def test_history_page_uses_message_index(before):
+    plan = plan_for(*history_page_query(chat_id=1, limit=50, before=before))
+    assert plan_uses_index(plan, "idx_messages_chat_timestamp_id")
+    assert not plan_has_seq_scan(plan, "messages")
+    # The page is read in index order, not sorted after the fact
+    assert not sorts(plan)
+
+def test_chat_list_uses_user_index():
+    plan = plan_for(LIST_CHATS_QUERY, {"uid": 1})
+    assert plan_uses_index(plan, "idx_chats_user_created_at")
+    assert not plan_has_seq_scan(plan, "chats")
+    assert not sorts(plan)
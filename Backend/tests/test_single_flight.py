@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+class Upstream:
+    """Counts calls and lets the test decide when they finish."""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+        self.release = None
+
+    async def call(self):
+        self.calls += 1
+        number = self.calls
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return f"result {number}"
+
+    async def tokens(self, count=3):
+        self.calls += 1
+        try:
+            # The first item comes at once, the rest once released
+            for i in range(count):
+                yield i
+                await self.release.wait()
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
+
+def run(test):
+    async def main():
+        upstream = Upstream()
+        upstream.release = asyncio.Event()
+        await test(SingleFlight("test"), upstream)
+    asyncio.run(main())
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_do_coalesces_concurrent_callers():
+    async def test(flight, upstream):
+        waiters = [asyncio.ensure_future(flight.do("k", upstream.call)) for _ in range(3)]
+        other = asyncio.ensure_future(flight.do("other", upstream.call))
+        await settle()
+        upstream.release.set()
+        assert await asyncio.gather(*waiters) == ["result 1"] * 3
+        await other
+        assert upstream.calls == 2
+        assert flight.stats() == {"started": 2, "coalesced": 2, "in_flight": 0}
+
+        # A finished flight is not reused
+        assert await flight.do("k", upstream.call) == "result 3"
+    run(test)
+
+def test_do_shares_the_exception():
+    async def test(flight, upstream):
+        async def fail():
+            await upstream.release.wait()
+            raise ValueError("upstream down")
+        waiters = [asyncio.ensure_future(flight.do("k", fail)) for _ in range(2)]
+        await settle()
+        upstream.release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+        assert flight.stats()["in_flight"] == 0
+    run(test)
+
+def test_do_survives_one_waiter_cancelling():
+    async def test(flight, upstream):
+        leaving, staying = (asyncio.ensure_future(flight.do("k", upstream.call)) for _ in range(2))
+        await settle()
+        leaving.cancel()
+        await asyncio.gather(leaving, return_exceptions=True)
+        assert leaving.cancelled() and upstream.cancelled == 0
+
+        upstream.release.set()
+        assert await staying == "result 1"
+        assert upstream.calls == 1
+    run(test)
+
+def test_do_cancels_upstream_when_every_waiter_leaves():
+    async def test(flight, upstream):
+        waiters = [asyncio.ensure_future(flight.do("k", upstream.call)) for _ in range(2)]
+        await settle()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await settle()
+        assert upstream.cancelled == 1
+        assert flight.stats()["in_flight"] == 0
+    run(test)
+
+def test_stream_late_subscriber_sees_every_item():
+    async def test(flight, upstream):
+        async def consume():
+            return [item async for item in flight.stream("k", upstream.tokens)]
+        first = asyncio.ensure_future(consume())
+        await settle()  # the producer is already under way
+        second = asyncio.ensure_future(consume())
+        await settle()
+        upstream.release.set()
+        assert await first == [0, 1, 2]
+        assert await second == [0, 1, 2]
+        assert upstream.calls == 1
+        assert flight.stats() == {"started": 1, "coalesced": 1, "in_flight": 0}
+    run(test)
+
+def test_stream_keeps_producing_for_remaining_subscribers():
+    async def test(flight, upstream):
+        leaving = flight.stream("k", upstream.tokens)
+        staying = flight.stream("k", upstream.tokens)
+        assert await leaving.__anext__() == 0
+        assert await staying.__anext__() == 0
+        await leaving.aclose()
+        upstream.release.set()
+        assert [item async for item in staying] == [1, 2]
+        assert upstream.calls == 1 and upstream.cancelled == 0
+    run(test)
+
+def test_stream_cancels_producer_when_every_subscriber_leaves():
+    async def test(flight, upstream):
+        stream = flight.stream("k", upstream.tokens)
+        assert await stream.__anext__() == 0
+        await stream.aclose()
+        await settle()
+        assert upstream.cancelled == 1
+        assert flight.stats()["in_flight"] == 0
+    run(test)
+
+def test_stream_shares_the_exception():
+    async def test(flight, upstream):
+        async def failing():
+            yield "partial"
+            raise ValueError("upstream down")
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                [item async for item in flight.stream("k", failing)]
+    run(test)
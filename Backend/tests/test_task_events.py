@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import task_events
+from task_events import get_redis, close_redis
+
+def track_close(client, closed):
+    original = client.aclose
+    async def aclose():
+        closed.append(client)
+        await original()
+    client.aclose = aclose
+    return client
+
+def test_client_is_reused_on_its_loop_and_closed():
+    closed = []
+    async def main():
+        client = track_close(get_redis(), closed)
+        assert get_redis() is client
+        await close_redis()
+        assert task_events._client is None
+        return client
+    assert closed == [asyncio.run(main())]
+
+def test_client_of_a_running_loop_is_closed_when_replaced():
+    closed = []
+    other = asyncio.new_event_loop()
+    thread = threading.Thread(target=other.run_forever, daemon=True)
+    thread.start()
+    try:
+        async def create():
+            return track_close(get_redis(), closed)
+        old = asyncio.run_coroutine_threadsafe(create(), other).result()
+
+        async def main():
+            assert get_redis() is not old
+            await close_redis()
+        asyncio.run(main())
+
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), other).result()
+        assert old in closed
+    finally:
+        other.call_soon_threadsafe(other.stop)
+        thread.join()
+        other.close()
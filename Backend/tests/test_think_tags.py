@@ -0,0 +1,40 @@
+import pytest
+
+from utils import ThinkTagFilter, remove_think_tags
+
+def stream(chunks):
+    f = ThinkTagFilter()
+    return "".join(f.feed(c) for c in chunks) + f.flush()
+
+def split_every(text, n):
+    return [text[i:i + n] for i in range(0, len(text), n)]
+
+CASES = [
+    "<think>plan</think>Hello there",
+    "<think>a</think> Hi <think>b</think>there",
+    "No tags at all",
+    "Answer with a < sign and <thin words",
+    "<think>never closed, cut off mid-thought",
+    "Intro <think>still thinking",
+    "stray </think> close tag",
+]
+
+@pytest.mark.parametrize("text", CASES)
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 1000])
+def test_stream_matches_remove_think_tags(text, size):
+    assert stream(split_every(text, size)).strip() == remove_think_tags(text)
+
+def test_tags_split_across_chunks():
+    assert stream(["<th", "ink>hidden</th", "ink>", "vis", "ible"]) == "visible"
+
+def test_partial_tag_is_held_back_until_decided():
+    f = ThinkTagFilter()
+    assert f.feed("Hello <thi") == "Hello "
+    assert f.feed("s is fine") == "<this is fine"
+
+def test_unclosed_think_is_dropped():
+    assert stream(["<think>", "reasoning that never ends"]) == ""
+    assert remove_think_tags("<think>reasoning that never ends") == ""
+
+def test_leading_whitespace_after_think_is_stripped():
+    assert stream(["<think>x</think>", "\n\n", "Answer"]) == "Answer"
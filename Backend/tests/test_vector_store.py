@@ -0,0 +1,30 @@
+import hashlib
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from embedding_cache import cache_key, EMBEDDING_CACHE_VERSION
+from vector_store import normalize, normalize_index, get_embedding_model
+
+def norms(vectors):
+    return np.linalg.norm(np.asarray(vectors, dtype=np.float32), axis=1)
+
+def test_normalize_returns_unit_vectors():
+    vectors = normalize([[3.0, 4.0], [0.0, 2.0], [0.0, 0.0]])
+    assert np.allclose(vectors[:2], [[0.6, 0.8], [0.0, 1.0]])
+    assert vectors[2] == [0.0, 0.0]  # zero vectors stay zero instead of becoming NaN
+
+def test_legacy_index_is_normalized_in_place():
+    index = FAISS.from_embeddings([("a", [3.0, 4.0]), ("b", [0.0, 2.0])], get_embedding_model())
+    assert normalize_index(index)
+    assert np.allclose(norms(index.index.reconstruct_n(0, 2)), 1.0)
+    # Positions are kept, so documents still line up with their vectors
+    docs = index.similarity_search_by_vector([0.0, 1.0], k=1)
+    assert docs[0].page_content == "b"
+    assert not normalize_index(index)
+
+def test_cache_key_is_versioned():
+    assert EMBEDDING_CACHE_VERSION >= 2
+    assert cache_key("m", "text") != cache_key("m", "text2")
+    # Entries written before vectors were normalized are keyed without a version
+    assert cache_key("m", "text") != hashlib.sha256("m\0text".encode()).digest()
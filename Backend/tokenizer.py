@@ -0,0 +1,67 @@
+# tokenizer.py
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Hashable, Optional
+
+if TYPE_CHECKING:
+    import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+DEFAULT_ENCODING = os.getenv("TOKENIZER_DEFAULT_ENCODING", "cl100k_base")
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "100000"))
+
+# ---- Encoder registry ----
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+def get_encoding(model: str = "gpt-3.5-turbo") -> "tiktoken.Encoding":
+    # Resolve once per model name; Ollama names like "gemma:2b" map to the default encoding
+    encoding = _encoders.get(model)
+    if encoding is not None:
+        return encoding
+    with _encoders_lock:
+        if model not in _encoders:
+            import tiktoken  # imported with the first encoding, not with the app
+            try:
+                _encoders[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encoders[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+        return _encoders[model]
+
+# ---- Token-count cache ----
+class TokenCountCache:
+    """LRU of token counts for immutable text (stored messages, summaries,
+    file chunks), keyed by an explicit id or by the text's content hash."""
+
+    def __init__(self, max_entries: int = TOKEN_COUNT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: str, model: str = "gpt-3.5-turbo", key: Optional[Hashable] = None) -> int:
+        encoding = get_encoding(model)
+        if key is None:
+            key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        cache_key = (encoding.name, key)
+        with self._lock:
+            count = self._counts.get(cache_key)
+            if count is not None:
+                self._counts.move_to_end(cache_key)
+                self.hits += 1
+                return count
+            self.misses += 1
+        count = len(encoding.encode(text, disallowed_special=()))
+        with self._lock:
+            self._counts[cache_key] = count
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return count
+
+token_counts = TokenCountCache()
@@ -1,20 +1,149 @@
 import os
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OllamaEmbeddings
 from langchain.docstore.document import Document
+from typing import List, Optional
+from http_client import get_http_session, get_sync_session, SYNC_TIMEOUT
+from embedding_cache import embedding_cache
+from embedding_batcher import EmbeddingBatcher, EMBED_BATCH_MAX_SIZE
+from metrics import EMBED_BATCH_SECONDS, EMBED_BATCH_SIZE
+import asyncio
 import logging
+import threading
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
-# Initialize embedding model globally
-try:
-    embedding_model = OllamaEmbeddings(model="nomic-embed-text")
-    logger.info(f"Ollama embedding model '{embedding_model.model}' initialized successfully.")
-except Exception as e:
-    logger.critical(f"CRITICAL ERROR: Could not initialize OllamaEmbeddings: {e}. FAISS will not work.")
-    embedding_model = None
+# Ollama node that serves the embedding model
+OLLAMA_EMBED_URL = os.getenv("OLLAMA_EMBED_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+def normalize(vectors: List[List[float]]) -> List[List[float]]:
+    # /api/embed returns unit vectors and the old /api/embeddings did not; normalizing
+    # everything keeps one scale for L2/MMR search across old and new vectors
+    array = np.asarray(vectors, dtype=np.float32)
+    if array.size == 0:
+        return [list(v) for v in vectors]
+    norms = np.linalg.norm(array, axis=1, keepdims=True)
+    return (array / np.where(norms > 0, norms, 1)).tolist()
+
+def normalize_index(index) -> bool:
+    """Rescale the vectors of an index written before embeddings were
+    normalized. Positions are kept, so the docstore mapping still holds.
+    Returns True if anything changed."""
+    flat = index.index
+    if flat.ntotal == 0:
+        return False
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    norms = np.linalg.norm(vectors, axis=1)
+    if np.allclose(norms[norms > 0], 1.0, atol=1e-3):
+        return False
+    flat.reset()
+    flat.add(np.asarray(normalize(vectors), dtype=np.float32))
+    return True
+
+class PooledEmbeddingsMixin:
+    """Mixed into OllamaEmbeddings: reuses the shared keep-alive HTTP clients,
+    consults the content-addressed embedding cache and sends misses to Ollama's
+    batch /api/embed endpoint (micro-batched across concurrent async callers).
+
+    A mixin so langchain_community is imported when the embedding model is
+    built, not when the API imports this module."""
+
+    def _embed(self, input: List[str]) -> List[List[float]]:
+        # Sync bulk path (e.g. FAISS.from_documents): cached vectors first, the rest in batches
+        vectors = [embedding_cache.get(self.model, t) if embedding_cache is not None else None for t in input]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        for start in range(0, len(missing), EMBED_BATCH_MAX_SIZE):
+            rows = missing[start:start + EMBED_BATCH_MAX_SIZE]
+            for i, vector in zip(rows, self._request_embeddings([input[i] for i in rows])):
+                vectors[i] = vector
+                if embedding_cache is not None:
+                    embedding_cache.put(self.model, input[i], vector)
+        return vectors
+
+    async def _aprocess_emb_response(self, input: str) -> List[float]:
+        if embedding_cache is not None:
+            cached = await embedding_cache.aget(self.model, input)
+            if cached is not None:
+                return cached
+        vector = await self._batcher().embed(input)
+        if embedding_cache is not None:
+            await embedding_cache.aput(self.model, input, vector)
+        return vector
+
+    def _batcher(self) -> EmbeddingBatcher:
+        key = (self.base_url, self.model)
+        if key not in _batchers:
+            _batchers[key] = EmbeddingBatcher(self._arequest_embeddings)
+        return _batchers[key]
+
+    def _options(self) -> dict:
+        return {k: v for k, v in self._default_params["options"].items() if v is not None}
+
+    def _request_embeddings(self, inputs: List[str]) -> List[List[float]]:
+        EMBED_BATCH_SIZE.observe(len(inputs))
+        with EMBED_BATCH_SECONDS.time():
+            res = get_sync_session().post(
+                f"{self.base_url}/api/embed",
+                headers={"Content-Type": "application/json", **(self.headers or {})},
+                json={"model": self.model, "input": inputs, "options": self._options()},
+                timeout=SYNC_TIMEOUT,
+            )
+        if res.status_code != 200:
+            raise ValueError(f"Error raised by inference API HTTP code: {res.status_code}, {res.text}")
+        return normalize(res.json()["embeddings"])
+
+    async def _arequest_embeddings(self, inputs: List[str]) -> List[List[float]]:
+        EMBED_BATCH_SIZE.observe(len(inputs))
+        with EMBED_BATCH_SECONDS.time():
+            async with get_http_session().post(
+                f"{self.base_url}/api/embed",
+                headers={"Content-Type": "application/json", **(self.headers or {})},
+                json={"model": self.model, "input": inputs, "options": self._options()},
+            ) as res:
+                if res.status != 200:
+                    raise ValueError(f"Error raised by inference API HTTP code: {res.status}, {await res.text()}")
+                return normalize((await res.json())["embeddings"])
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Concurrent lookups land in the same micro-batch as other users' requests
+        return list(await asyncio.gather(*(self._aprocess_emb_response(f"{self.embed_instruction}{t}") for t in texts)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self._aprocess_emb_response(f"{self.query_instruction}{text}")
+
+    async def awarm(self):
+        # Straight to Ollama (a cache hit would skip it) so the model gets loaded
+        await self._arequest_embeddings(["warmup"])
+
+_batchers = {}
+
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+def get_embedding_model() -> Optional[PooledEmbeddingsMixin]:
+    # Built on first use (or by warmup) rather than at import; None if it can't be
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                try:
+                    from langchain_community.embeddings import OllamaEmbeddings
+                    PooledOllamaEmbeddings = type("PooledOllamaEmbeddings", (PooledEmbeddingsMixin, OllamaEmbeddings), {"__module__": __name__})
+                    _embedding_model = PooledOllamaEmbeddings(model=OLLAMA_EMBED_MODEL, base_url=OLLAMA_EMBED_URL)
+                    logger.info(f"Ollama embedding model '{_embedding_model.model}' initialized successfully.")
+                except Exception as e:
+                    logger.critical(f"CRITICAL ERROR: Could not initialize OllamaEmbeddings: {e}. FAISS will not work.")
+                    return None
+    return _embedding_model
+
+def preload_faiss():
+    # FAISS imports its native library on first use; do that before the first request
+    from langchain_community.vectorstores.faiss import dependable_faiss_import
+    dependable_faiss_import()
 
 def get_faiss_index(chat_id):
+    from langchain_community.vectorstores import FAISS
+    embedding_model = get_embedding_model()
     if embedding_model is None:
         logger.error("Embedding model is not initialized. Cannot create/load FAISS index.")
         raise RuntimeError("Embedding model not initialized.")
@@ -35,6 +164,9 @@ def get_faiss_index(chat_id):
             if index is None or not hasattr(index, "index") or index.index.ntotal == 0:
                 logger.warning(f"Loaded FAISS index is empty or corrupted for chat {chat_id}. Initializing new.")
                 return FAISS.from_documents([Document(page_content="")], embedding_model)
+            if normalize_index(index):
+                # Persisted with the chat's next write
+                logger.info(f"Normalized legacy vectors in FAISS index for chat {chat_id}")
             return index
         except Exception as e:
             logger.error(f"Failed to load FAISS index for chat {chat_id}: {e}")
@@ -46,7 +178,7 @@ def get_faiss_index(chat_id):
     return FAISS.from_documents([Document(page_content="")], embedding_model)  # add dummy doc to avoid empty index error
 
 def save_faiss_index(index, chat_id):
-    if embedding_model is None:
+    if get_embedding_model() is None:
         logger.warning("Embedding model not initialized. Cannot save FAISS index.")
         return
 
@@ -62,3 +194,4 @@ def save_faiss_index(index, chat_id):
         logger.info(f"Saved FAISS index for chat {chat_id} to {path}.")
     except Exception as e:
         logger.error(f"Error saving FAISS index for chat {chat_id}: {e}")
+        raise  # the index manager keeps the entry dirty and retries
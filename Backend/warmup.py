@@ -0,0 +1,97 @@
+# warmup.py
+import os
+import asyncio
+import logging
+from typing import Iterable, Optional
+
+import aiohttp
+
+from http_client import get_http_session
+from ollama_pool import ollama_pool, normalize_model, OllamaNode, OLLAMA_KEEP_ALIVE
+from context_builder import get_context_limit
+from tokenizer import get_encoding
+from vector_store import get_embedding_model, preload_faiss
+from metrics import startup_phase
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# Chat models loaded on every healthy node at startup (comma-separated; empty to skip)
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "mistral").split(",") if m.strip()]
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "120"))
+
+def _warm_tokenizer(models: Iterable[str]):
+    # The first get_encoding() reads (or, on a cold cache, downloads) the BPE ranks
+    for model in ["gpt-3.5-turbo", *models]:
+        get_encoding(model)
+
+async def _load_model(node: OllamaNode, model: str, num_ctx: int):
+    # A generate request without a prompt only loads the model. It must ask
+    # for the num_ctx chat turns will use, or the first turn reloads it.
+    payload = {"model": model, "options": {"num_ctx": num_ctx}}
+    if OLLAMA_KEEP_ALIVE:
+        payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+    async with get_http_session().post(node.generate_url, json=payload) as resp:
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status}: {await resp.text()}")
+        await resp.read()
+
+async def _warm_ollama(process: str, models: Iterable[str], embeddings: bool):
+    with startup_phase(process, "ollama_ping"):
+        await ollama_pool.check_all()
+
+    loads = [
+        (node, model) for model in models for node in ollama_pool.healthy_nodes()
+        if normalize_model(model) not in node.loaded_models
+    ]
+    context_limits = {model: await get_context_limit(model) for model in {m for _, m in loads}}
+
+    async def load(node: OllamaNode, model: str):
+        try:
+            await _load_model(node, model, context_limits[model])
+        except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+            logger.warning(f"Could not load '{model}' on {node.base_url}: {e}")
+
+    async def load_embedding_model():
+        try:
+            await get_embedding_model().awarm()
+        except Exception as e:
+            logger.warning(f"Could not warm the embedding model: {e}")
+
+    with startup_phase(process, "model_load"):
+        await asyncio.gather(
+            *(load(node, model) for node, model in loads),
+            *([load_embedding_model()] if embeddings else []),
+        )
+    if loads:
+        await ollama_pool.check_all()  # pick up the newly loaded models for routing
+
+async def _run(process: str, models: Iterable[str], embeddings: bool):
+    loop = asyncio.get_running_loop()
+
+    async def in_thread(phase: str, fn, *args):
+        try:
+            with startup_phase(process, phase):
+                await loop.run_in_executor(None, fn, *args)
+        except Exception as e:
+            logger.warning(f"Warmup step '{phase}' failed: {e}")
+
+    steps = [in_thread("tokenizer", _warm_tokenizer, models), _warm_ollama(process, models, embeddings)]
+    if embeddings:
+        steps.append(in_thread("faiss", preload_faiss))
+    await asyncio.gather(*steps)
+
+async def warmup(process: str, models: Optional[Iterable[str]] = None, embeddings: bool = True):
+    """Pay the first request's one-off costs up front: tokenizer encodings,
+    the FAISS library, and loading the chat and embedding models on the
+    Ollama nodes. Failures and timeouts are logged, not raised: a cold
+    start is slower, not broken."""
+    if not WARMUP_ENABLED:
+        return
+    models = list(WARMUP_MODELS if models is None else models)
+    try:
+        with startup_phase(process, "warmup"):
+            await asyncio.wait_for(_run(process, models, embeddings), WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Warmup did not finish within {WARMUP_TIMEOUT:.0f}s; continuing cold")
@@ -0,0 +1,109 @@
+# worker_runtime.py
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Optional, TypeVar
+
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+
+from http_client import start_http_client, close_http_client
+from task_events import close_redis
+from celery_worker import CELERY_WORKER_MODELS
+from metrics import startup_phase
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class WorkerRuntime:
+    """One event loop per worker process, running in a background thread,
+    with the DB pool, HTTP client and Redis client opened on it once.
+
+    Task bodies are submitted with run(); this works the same under the
+    prefork, solo and threads pools.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._loop is not None
+
+    def start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="worker-runtime", daemon=True)
+            thread.start()
+            try:
+                with startup_phase("worker", "runtime"):
+                    asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+            except Exception:
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+                raise
+            self._loop, self._thread = loop, thread
+            logger.info("Worker runtime started (event loop, DB pool, HTTP client)")
+            from warmup import warmup
+            # Not waited for: a prefork child must finish init quickly, and tasks can run cold meanwhile
+            asyncio.run_coroutine_threadsafe(warmup("worker", CELERY_WORKER_MODELS or None, embeddings=False), loop)
+
+    # utils (and through it the LLM and FAISS stack) is imported when the
+    # runtime starts in a worker process, not when tasks.py is imported
+    async def _open(self):
+        from utils import database
+        await database.connect()
+        await start_http_client()
+
+    async def _close(self):
+        from utils import database
+        await close_redis()
+        await close_http_client()
+        await database.disconnect()
+
+    def stop(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result(timeout=30)
+        except Exception as e:
+            logger.warning(f"Error closing worker runtime: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+        loop.close()
+        logger.info("Worker runtime stopped")
+
+    def reset_after_fork(self):
+        # A forked child inherits the parent's objects but not its loop thread
+        self._loop, self._thread = None, None
+        self._lock = threading.Lock()
+
+    def run(self, coro: Awaitable[T]) -> T:
+        if self._loop is None:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+worker_runtime = WorkerRuntime()
+
+# ---- Celery lifecycle hooks ----
+@worker_process_init.connect
+def _start_process_runtime(**kwargs):
+    worker_runtime.reset_after_fork()
+    worker_runtime.start()
+
+@worker_process_shutdown.connect
+def _stop_process_runtime(**kwargs):
+    worker_runtime.stop()
+
+@worker_shutdown.connect
+def _stop_worker_runtime(**kwargs):
+    # solo/threads pools run tasks in the main process, which gets no process signals
+    worker_runtime.stop()
@@ -8,6 +8,7 @@ import { Pencil } from "lucide-react";
 import { visit } from "unist-util-visit";
 import rehypeRaw from "rehype-raw";
 
+const HISTORY_PAGE_SIZE = 50;
 
 const remarkHighlight = (query) => () => (tree) => {
   if (!query?.trim()) return;
@@ -47,65 +48,156 @@ const Chat = ({
   const [attachedFile, setAttachedFile] = useState(null);
   const [isRecording, setIsRecording] = useState(false);
   const [editingIndex, setEditingIndex] = useState(null);
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [loadingEarlier, setLoadingEarlier] = useState(false);
   const chatEndRef = useRef(null);
+  const chatContainerRef = useRef(null);
+  const prependHeightRef = useRef(null);
   const fileInputRef = useRef(null);
   const user = JSON.parse(localStorage.getItem("user"));
   const username = user?.username || "Guest";
   const userAvatar = `https://api.dicebear.com/7.x/initials/svg?seed=${username}`;
   const highlightedIndexRef = useRef(-1);
+  const controllerRef = useRef(null);
   useEffect(() => {
+    controllerRef.current = controller;
+  }, [controller]);
+  // Leaving the chat view aborts the request, which also stops the generation on the server
+  useEffect(() => () => controllerRef.current?.abort(), []);
+  useEffect(() => {
+    if (prependHeightRef.current !== null) return;
     chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messageData, loading]);
   useEffect(() => {
+    if (prependHeightRef.current !== null) return;
     chatEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messageData, loading]);
+  useEffect(() => {
+    // Keep the viewport on the same message after older history is prepended
+    const container = chatContainerRef.current;
+    if (prependHeightRef.current === null || !container) return;
+    container.scrollTop += container.scrollHeight - prependHeightRef.current;
+    prependHeightRef.current = null;
+  }, [messageData]);
+  const fetchHistoryPage = (before) =>
+    axios.get("http://localhost:8000/api/chat_history", {
+      params: { chat_id: selectedChatId, limit: HISTORY_PAGE_SIZE, before },
+      withCredentials: true,
+    });
+  const formatHistory = (messages) =>
+    messages.map((m) => ({
+      type: m.role === "user" ? "Sender" : "Receiver",
+      message: m.content,
+    }));
   useEffect(() => {
     const loadChatHistory = async () => {
       if (!selectedChatId) return;
+      setHistoryCursor(null);
       try {
-        const res = await axios.get(
-          `http://localhost:8000/api/chat_history?chat_id=${selectedChatId}`,
-          { withCredentials: true }
-        );
-        const formatted = res.data.map((m) => ({
-          type: m.role === "user" ? "Sender" : "Receiver",
-          message: m.content,
-        }));
-        setMessageData(formatted);
+        const res = await fetchHistoryPage();
+        setMessageData(formatHistory(res.data.messages));
+        setHistoryCursor(res.data.has_more ? res.data.next_cursor : null);
       } catch (err) {
         console.error("Failed to load history:", err);
       }
     };
     loadChatHistory();
   }, [selectedChatId]);
-  const pollForResponse = async (taskId, chatId) => {
-  const pollInterval = 1000; // 1s
-  const maxAttempts = 60; // 1 minute max
-  let attempts = 0;
+  const loadEarlierMessages = async () => {
+    if (!historyCursor || loadingEarlier) return;
+    setLoadingEarlier(true);
+    try {
+      const res = await fetchHistoryPage(historyCursor);
+      prependHeightRef.current = chatContainerRef.current?.scrollHeight ?? 0;
+      setMessageData((prev) => [...formatHistory(res.data.messages), ...prev]);
+      setHistoryCursor(res.data.has_more ? res.data.next_cursor : null);
+    } catch (err) {
+      console.error("Failed to load earlier messages:", err);
+    } finally {
+      setLoadingEarlier(false);
+    }
+  };
+  const handleChatScroll = (e) => {
+    if (e.currentTarget.scrollTop < 50) loadEarlierMessages();
+  };
+  // Background (Celery) generations push partial output and completion over SSE
+  const subscribeToTask = (taskId, chatId, signal) =>
+    new Promise((resolve, reject) => {
+      const source = new EventSource(
+        `http://localhost:8000/api/task_events?task_id=${taskId}&chat_id=${chatId}`,
+        { withCredentials: true }
+      );
+      let streamed = "";
+      setMessageData((prev) => [...prev, { type: "Receiver", message: "" }]);
+      const updateLast = (text) =>
+        setMessageData((prev) => [
+          ...prev.slice(0, -1),
+          { type: "Receiver", message: text },
+        ]);
+      const finish = (callback) => {
+        source.close();
+        signal.removeEventListener("abort", onAbort);
+        callback();
+      };
+      const onAbort = () => {
+        // Closing the event stream alone only stops the worker after a grace period
+        fetch(
+          `http://localhost:8000/api/cancel_task?task_id=${taskId}&chat_id=${chatId}`,
+          { method: "POST", credentials: "include" }
+        ).catch(() => {});
+        finish(() => reject(new DOMException("Aborted", "AbortError")));
+      };
+      signal.addEventListener("abort", onAbort);
 
-  return new Promise((resolve, reject) => {
-    const interval = setInterval(async () => {
-      try {
-        const res = await axios.get(`http://localhost:8000/api/task_status?task_id=${taskId}`);
-        if (res.data.status === "done") {
-          clearInterval(interval);
-          resolve(res.data.response);
-        } else if (res.data.status === "error") {
-          clearInterval(interval);
-          reject(new Error(res.data.message || "Task failed"));
+      source.onmessage = (e) => {
+        const event = JSON.parse(e.data);
+        if (event.token) {
+          streamed += event.token;
+          updateLast(streamed);
+        } else if (event.done) {
+          updateLast(event.response ?? streamed);
+          finish(() => resolve(event.response ?? streamed));
+        } else if (event.error) {
+          updateLast(streamed || "⚠️ Failed to fetch response from background task.");
+          finish(() => reject(new Error(event.error)));
         }
-      } catch (err) {
-        clearInterval(interval);
-        reject(err);
-      }
+      };
+      source.onerror = () => {
+        updateLast(streamed || "⚠️ Failed to fetch response from background task.");
+        finish(() => reject(new Error("Lost connection to task events")));
+      };
+    });
 
-      if (++attempts >= maxAttempts) {
-        clearInterval(interval);
-        reject(new Error("Timeout waiting for response"));
+  const readResponseStream = async (res) => {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let streamed = "";
+    setMessageData((prev) => [...prev, { type: "Receiver", message: "" }]);
+    const updateLast = (text) =>
+      setMessageData((prev) => [
+        ...prev.slice(0, -1),
+        { type: "Receiver", message: text },
+      ]);
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const event = JSON.parse(line);
+        if (event.token) {
+          streamed += event.token;
+          updateLast(streamed);
+        } else if (event.error) {
+          updateLast(streamed || "⚠️ Error getting response.");
+        }
       }
-    }, pollInterval);
-  });
-};
+    }
+  };
 
   const handleSubmit = async () => {
     if (!typedValue.trim() && !attachedFile) return;
@@ -160,43 +252,55 @@ const Chat = ({
       if (attachedFile) {
         formData.append("file", attachedFile);
       }
-      const res = await axios.post("http://localhost:8000/api/respond", formData, {
-        withCredentials: true,
+      formData.append("stream", "true");
+      const res = await fetch("http://localhost:8000/api/respond", {
+        method: "POST",
+        body: formData,
+        credentials: "include",
         signal: abortController.signal,
-        headers: { "Content-Type": "multipart/form-data" },
       });
-      let finalResponse = res.data?.response;
+      if (!res.ok) {
+        const error = new Error(`Request failed with status ${res.status}`);
+        // 429/503 from admission control say when to try again
+        error.retryAfter = res.headers.get("Retry-After");
+        throw error;
+      }
+
+      if (res.headers.get("content-type")?.includes("application/x-ndjson")) {
+        await readResponseStream(res);
+      } else {
+        const data = await res.json();
+        const finalResponse = data?.response;
 
-      if (res.data.task_id) {
-        try {
-          finalResponse = await pollForResponse(res.data.task_id, currentChatId);
-        } catch (pollError) {
-          console.error("Polling failed:", pollError);
-          finalResponse = "⚠️ Failed to fetch response from background task.";
+        if (data.task_id) {
+          try {
+            await subscribeToTask(data.task_id, currentChatId, abortController.signal);
+          } catch (taskError) {
+            if (taskError.name === "AbortError") throw taskError;
+            console.error("Background task failed:", taskError);
+          }
+        } else if (!abortController.signal.aborted && finalResponse?.trim()) {
+          const assistantMessage = {
+            type: "Receiver",
+            message: finalResponse,
+          };
+          setMessageData((prev) => [...prev, assistantMessage]);
         }
       }
 
-if (!abortController.signal.aborted && finalResponse?.trim()) {
-  const assistantMessage = {
-    type: "Receiver",
-    message: finalResponse,
-  };
-  setMessageData((prev) => [...prev, assistantMessage]);
-}
-
       const refreshed = await axios.get("http://localhost:8000/api/list_chats", {
         withCredentials: true,
       });
       setChatHistory(refreshed.data.chats || []);
     } catch (err) {
-      if (axios.isCancel(err)) {
+      if (axios.isCancel(err) || err.name === "AbortError") {
         console.log("Request cancelled by user");
       } else {
         console.error("Error generating response:", err);
-        setMessageData((prev) => [
-          ...prev,
-          { type: "Receiver", message: "⚠️ Error getting response." },
-        ]);
+        const message = err.retryAfter
+          ? `⚠️ The server is busy. Please try again in ${err.retryAfter}s.`
+          : "⚠️ Error getting response.";
+        setMessageData((prev) => [...prev, { type: "Receiver", message }]);
       }
     } finally {
       setLoading(false);
@@ -279,7 +383,22 @@ if (!abortController.signal.aborted && finalResponse?.trim()) {
 
   return (
     <div className="flex flex-col h-full">
-      <div className="flex-1 overflow-y-auto chat-scrollbar p-4 space-y-6">
+      <div
+        ref={chatContainerRef}
+        onScroll={handleChatScroll}
+        className="flex-1 overflow-y-auto chat-scrollbar p-4 space-y-6"
+      >
+        {historyCursor && (
+          <div className="flex justify-center">
+            <button
+              onClick={loadEarlierMessages}
+              disabled={loadingEarlier}
+              className="text-sm text-gray-500 hover:text-gray-700 dark:hover:text-gray-300"
+            >
+              {loadingEarlier ? "Loading..." : "Load earlier messages"}
+            </button>
+          </div>
+        )}
         {!selectedModel && messageData.length === 0 ? (
           <div className="h-full flex items-center justify-center text-gray-500">
             <p className="text-lg">Please select a model to begin chatting.</p>
@@ -4,25 +4,33 @@ import axios from "axios";
 import ReactMarkdown from "react-markdown";
 import BubbleChartIcon from "@mui/icons-material/BubbleChart"; // ✅ New Icon
 
+const HISTORY_PAGE_SIZE = 50;
+const formatMessages = (messages) =>
+  messages.map((m) => ({
+    type: m.role === "user" ? "Sender" : "Receiver",
+    message: m.content,
+  }));
+
 const SharedChat = () => {
   const { chat_id } = useParams();
   const [messages, setMessages] = useState([]);
   const [error, setError] = useState("");
+  const [cursor, setCursor] = useState(null);
+  const [loadingEarlier, setLoadingEarlier] = useState(false);
   const messagesEndRef = useRef(null);
+  const prependedRef = useRef(false);
+
+  const fetchPage = (before) =>
+    axios.get("http://localhost:8000/api/shared_chat_history", {
+      params: { chat_id, limit: HISTORY_PAGE_SIZE, before },
+    });
 
   useEffect(() => {
     const fetchChat = async () => {
       try {
-        const res = await axios.get("http://localhost:8000/api/shared_chat_history", {
-          params: { chat_id },
-        });
-
-        const formatted = res.data.map((m) => ({
-          type: m.role === "user" ? "Sender" : "Receiver",
-          message: m.content,
-        }));
-
-        setMessages(formatted);
+        const res = await fetchPage();
+        setMessages(formatMessages(res.data.messages));
+        setCursor(res.data.has_more ? res.data.next_cursor : null);
       } catch (err) {
         console.error("Error loading shared chat:", err);
         setError("⚠️ Unable to load shared chat.");
@@ -32,7 +40,27 @@ const SharedChat = () => {
     fetchChat();
   }, [chat_id]);
 
+  const loadEarlier = async () => {
+    if (!cursor || loadingEarlier) return;
+    setLoadingEarlier(true);
+    try {
+      const res = await fetchPage(cursor);
+      prependedRef.current = true;
+      setMessages((prev) => [...formatMessages(res.data.messages), ...prev]);
+      setCursor(res.data.has_more ? res.data.next_cursor : null);
+    } catch (err) {
+      console.error("Error loading earlier messages:", err);
+    } finally {
+      setLoadingEarlier(false);
+    }
+  };
+
   useEffect(() => {
+    // Older pages go on top; only new loads should jump to the bottom
+    if (prependedRef.current) {
+      prependedRef.current = false;
+      return;
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messages]);
 
@@ -45,6 +73,17 @@ const SharedChat = () => {
 
       {/* Chat Body */}
       <div className="flex-1 px-4 py-6 space-y-4 overflow-y-auto scrollbar-hide">
+        {cursor && (
+          <div className="flex justify-center">
+            <button
+              onClick={loadEarlier}
+              disabled={loadingEarlier}
+              className="text-sm text-gray-500 hover:text-gray-700"
+            >
+              {loadingEarlier ? "Loading..." : "Load earlier messages"}
+            </button>
+          </div>
+        )}
         {error ? (
           <p className="text-red-500">{error}</p>
         ) : messages.length === 0 ? (